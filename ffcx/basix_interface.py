@@ -1,3 +1,5 @@
+import functools
+
 import numpy
 import ufl
 import basix
@@ -23,7 +25,14 @@ ufl_to_basix_names = {
 }
 
 
+@functools.lru_cache(maxsize=256)
 def create_basix_element(ufl_element):
+    """Create the basix element wrapper for a UFL element.
+
+    Elements are memoized on the UFL element for the lifetime of the
+    process, so each is constructed once and shared by all later
+    compilations. Use create_basix_element.cache_clear() to drop them.
+    """
     # TODO: EnrichedElement
     # TODO: Short/alternative names for elements
 
@@ -67,10 +76,29 @@ def map_facet_points(points, facet, cellname):
             for p in points]
 
 
+def _cached_property(method):
+    """Property computed on first access and then stored on the instance."""
+    name = "_cached_" + method.__name__
+
+    @functools.wraps(method)
+    def getter(self):
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            value = self.__dict__[name] = method(self)
+            return value
+    return property(getter)
+
+
 class BasixBaseElement:
     def tabulate(self, nderivs, points):
         raise NotImplementedError
 
+    @_cached_property
+    def interpolation_is_identity(self):
+        im = self.interpolation_matrix
+        return im.shape[0] == im.shape[1] and numpy.allclose(im, numpy.identity(im.shape[0]))
+
     @property
     def base_permutations(self):
         raise NotImplementedError
@@ -131,11 +159,11 @@ class BasixElement(BasixBaseElement):
     def tabulate(self, nderivs, points):
         return self.element.tabulate(nderivs, points)
 
-    @property
+    @_cached_property
     def base_permutations(self):
         return self.element.base_permutations
 
-    @property
+    @_cached_property
     def interpolation_matrix(self):
         return self.element.interpolation_matrix
 
@@ -159,7 +187,7 @@ class BasixElement(BasixBaseElement):
     def entity_dofs(self):
         return self.element.entity_dofs
 
-    @property
+    @_cached_property
     def entity_dof_numbers(self):
         # TODO: move this to basix, then remove this wrapper class
         start_dof = 0
@@ -212,7 +240,7 @@ class MixedElement(BasixBaseElement):
             tables.append(new_table)
         return tables
 
-    @property
+    @_cached_property
     def base_permutations(self):
         for e in self.sub_elements[1:]:
             assert len(e.base_permutations) == len(self.sub_elements[0].base_permutations)
@@ -233,7 +261,7 @@ class MixedElement(BasixBaseElement):
             output.append(new_perm)
         return output
 
-    @property
+    @_cached_property
     def interpolation_matrix(self):
         try:
             matrix = numpy.zeros((self.dim, len(self.points) * self.value_size))
@@ -273,7 +301,7 @@ class MixedElement(BasixBaseElement):
         return [[sum(d[tdim][entity_n] for d in data) for entity_n, _ in enumerate(entities)]
                 for tdim, entities in enumerate(data[0])]
 
-    @property
+    @_cached_property
     def entity_dof_numbers(self):
         dofs = [[[] for i in entities] for entities in self.sub_elements[0].entity_dof_numbers]
         start_dof = 0
@@ -329,7 +357,7 @@ class BlockedElement(BasixBaseElement):
             output.append(new_table)
         return output
 
-    @property
+    @_cached_property
     def base_permutations(self):
         assert len(self.block_shape) == 1  # TODO: block shape
 
@@ -341,7 +369,7 @@ class BlockedElement(BasixBaseElement):
             output.append(new_perm)
         return output
 
-    @property
+    @_cached_property
     def interpolation_matrix(self):
         sub_mat = self.sub_element.interpolation_matrix
         assert self.value_size == self.block_size  # TODO: remove this assumption
@@ -376,7 +404,7 @@ class BlockedElement(BasixBaseElement):
     def entity_dofs(self):
         return [[j * self.block_size for j in i] for i in self.sub_element.entity_dofs]
 
-    @property
+    @_cached_property
     def entity_dof_numbers(self):
         # TODO: should this return this, or should it take blocks into account?
         return [[[k * self.block_size + b for k in j for b in range(self.block_size)]
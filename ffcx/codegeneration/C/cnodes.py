@@ -1329,10 +1329,10 @@ class ArrayDecl(CStatement):
         elif _is_zero_valued(self.values):
             # Zero initial values
             # (NB! C style zero initialization, not sure about other target languages)
-            nb = len(sizes)
-            lbr = "{" * nb
-            rbr = "}" * nb
-            return f"{decl} = {lbr} 0 {rbr};"
+            # The universal zero initializer also works for arrays of
+            # vectors, where the braces of the array dimensions are not
+            # enough for -Wmissing-braces.
+            return f"{decl} = {{ 0 }};"
         else:
             # Construct initializer lists for arbitrary multidimensional array values
             if self.values.dtype.kind == "f":
@@ -0,0 +1,277 @@
+# Copyright (C) 2021 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Transformation of tabulate_tensor bodies into kernels for blocks of cells.
+
+The batched kernels take the arguments of a batch of cells in a
+structure-of-arrays layout: entry i of an argument of the single cell
+kernel is stored at [i * num_cells + cell] for each cell of the batch.
+The constants c are shared by all cells.
+
+Within a block of cells, every value which differs between cells is
+stored in an array over the cells of the block, and each run of
+statements computing such values is wrapped in a loop over the cells,
+innermost in the loop nest, so that the C compiler can vectorize
+across cells. Unless it is too large, the element tensor of the block
+is accumulated in a local array and added to A at the end, as the
+entries of A for a cell are num_cells apart.
+"""
+
+import numpy
+
+# Number of cells in a block. GCC completely unrolls loops over fewer
+# cells before vectorizing them, which leaves scalar code.
+default_block_size = 32
+
+# Maximum number of entries of the local element tensor of a block
+max_local_tensor_size = 16384
+
+# Arguments of the tabulate_tensor kernels which are given per cell
+cell_arguments = ("A", "w", "coordinate_dofs", "facet", "vertex", "quadrature_permutation", "cell_permutation")
+
+
+class CellBatcher(object):
+    """Rewrite a tabulate_tensor body to process a block of cells."""
+
+    def __init__(self, L, block_size, tensor_size):
+        self.L = L
+        self.block_size = block_size
+
+        # Size of the element tensor of a cell, and the local element
+        # tensor of the block if it is used
+        self.tensor_size = tensor_size
+        if tensor_size * block_size <= max_local_tensor_size:
+            self.local_tensor = L.Symbol("A_block")
+        else:
+            self.local_tensor = None
+
+        # Index of the cell in the block and number of cells in the block
+        self.cell = L.Symbol("icell")
+        self.num_block_cells = L.Symbol("num_block_cells")
+
+        # Stride between the entries of the arguments, and position of
+        # the block in the batch
+        self.num_cells = L.Symbol("num_cells")
+        self.first_cell = L.Symbol("first_cell")
+
+        # Local variables which have been given a cell dimension
+        self.cell_variables = set()
+
+    def batch(self, body):
+        """Return the statements of body rewritten for a block of cells."""
+        L = self.L
+        if self.local_tensor is None:
+            return L.StatementList(self.batch_statements([body]))
+
+        A = L.Symbol("A")
+        i = L.Symbol("i")
+        parts = [self.declare("ufc_scalar_t", self.local_tensor, (self.tensor_size, ), values=0)]
+        parts += self.batch_statements([body])
+        parts += [L.ForRange(i, 0, self.tensor_size, body=[
+            L.ForRange(self.cell, 0, self.num_block_cells, body=[
+                L.AssignAdd(A[i * self.num_cells + self.first_cell + self.cell], self.local_tensor[i, self.cell])])])]
+        return L.StatementList(parts)
+
+    def declare(self, typename, symbol, sizes, values=None, padlen=0):
+        """Return the declaration of a local variable holding a value for each cell of the block."""
+        self.cell_variables.add(symbol.name)
+        return self.L.ArrayDecl(typename, symbol, sizes + (self.block_size, ), values=values, padlen=padlen)
+
+    def vector_statement(self, s):
+        """Return statement s evaluated for all cells of the block at once, or None."""
+        return None
+
+    def depends_on_cell(self, e):
+        """Check if expression e has a different value for each cell."""
+        L = self.L
+        if isinstance(e, L.Symbol):
+            return e.name in self.cell_variables or e.name in cell_arguments
+        elif isinstance(e, L.CExprTerminal):
+            return False
+        elif isinstance(e, L.ArrayAccess):
+            return self.depends_on_cell(e.array) or any(self.depends_on_cell(i) for i in e.indices)
+        elif isinstance(e, L.UnaryOp):
+            return self.depends_on_cell(e.arg)
+        elif isinstance(e, L.BinOp):
+            return self.depends_on_cell(e.lhs) or self.depends_on_cell(e.rhs)
+        elif isinstance(e, L.NaryOp):
+            return any(self.depends_on_cell(arg) for arg in e.args)
+        elif isinstance(e, L.Conditional):
+            return any(self.depends_on_cell(arg) for arg in (e.condition, e.true, e.false))
+        elif isinstance(e, L.Call):
+            return any(self.depends_on_cell(arg) for arg in e.arguments)
+        raise RuntimeError(f"Cannot batch expression of type {type(e).__name__}.")
+
+    def batch_statements(self, statements):
+        L = self.L
+        parts = []
+        cell_parts = []
+
+        def flush():
+            if cell_parts:
+                parts.append(L.ForRange(self.cell, 0, self.num_block_cells, body=list(cell_parts)))
+                cell_parts.clear()
+
+        def add(s):
+            vector = self.vector_statement(s)
+            if vector is None:
+                cell_parts.append(L.Statement(self.batch_expr(s.expr)))
+            else:
+                flush()
+                parts.append(vector)
+
+        for s in statements:
+            s = L.as_cstatement(s)
+            if isinstance(s, L.StatementList):
+                flush()
+                parts += self.batch_statements(s.statements)
+            elif isinstance(s, L.Scope):
+                flush()
+                parts.append(L.Scope(self.batch_statements([s.body])))
+            elif isinstance(s, (L.Comment, L.Pragma, L.VerbatimStatement)):
+                flush()
+                parts.append(s)
+            elif isinstance(s, L.ArrayDecl):
+                # Declarations have no effect on the cell loops, and go
+                # before the loop using them
+                if s.typename.startswith("static"):
+                    parts.append(s)
+                    continue
+                if s.values is not None and numpy.any(s.values):
+                    raise RuntimeError(f"Cannot batch initialized array {s.symbol.name}.")
+                parts.append(self.declare(s.typename, s.symbol, s.sizes, values=s.values, padlen=s.padlen))
+            elif isinstance(s, L.VariableDecl):
+                parts.append(self.declare(s.typename.replace("const ", ""), s.symbol, ()))
+                if s.value is not None:
+                    add(L.Statement(L.Assign(s.symbol, s.value)))
+            elif isinstance(s, L.Statement):
+                add(s)
+            elif isinstance(s, L.ForRange):
+                flush()
+                if self.depends_on_cell(s.begin) or self.depends_on_cell(s.end):
+                    raise RuntimeError("Cannot batch loops over ranges depending on the cell.")
+                parts.append(L.ForRange(s.index, s.begin, s.end, body=self.batch_statements([s.body]),
+                                        index_type=s.index_type))
+            else:
+                raise RuntimeError(f"Cannot batch statement of type {type(s).__name__}.")
+        flush()
+        return parts
+
+    def batch_expr(self, e):
+        """Return expression e evaluated for the current cell of the block."""
+        L = self.L
+        if isinstance(e, L.Symbol):
+            if e.name in self.cell_variables:
+                return e[self.cell]
+            elif e.name in cell_arguments:
+                return e[self.first_cell + self.cell]
+            return e
+        elif isinstance(e, L.CExprTerminal):
+            return e
+        elif isinstance(e, L.ArrayAccess):
+            indices = [self.batch_expr(i) for i in e.indices]
+            name = e.array.name
+            if name == "A" and self.local_tensor is not None:
+                index, = indices
+                return self.local_tensor[index, self.cell]
+            elif name in self.cell_variables:
+                return e.array[indices + [self.cell]]
+            elif name in cell_arguments:
+                index, = indices
+                return e.array[index * self.num_cells + self.first_cell + self.cell]
+            return e.array[indices]
+        elif isinstance(e, L.UnaryOp):
+            return type(e)(self.batch_expr(e.arg))
+        elif isinstance(e, L.BinOp):
+            return type(e)(self.batch_expr(e.lhs), self.batch_expr(e.rhs))
+        elif isinstance(e, L.NaryOp):
+            return type(e)([self.batch_expr(arg) for arg in e.args])
+        elif isinstance(e, L.Conditional):
+            return L.Conditional(self.batch_expr(e.condition), self.batch_expr(e.true), self.batch_expr(e.false))
+        elif isinstance(e, L.Call):
+            return L.Call(e.function, [self.batch_expr(arg) for arg in e.arguments])
+        raise RuntimeError(f"Cannot batch expression of type {type(e).__name__}.")
+
+
+class SIMDCellBatcher(CellBatcher):
+    """Rewrite a tabulate_tensor body to process a block of cells in lockstep.
+
+    Local floating point variables become GCC vectors over the cells of
+    the block, and statements using only arithmetic operations are
+    evaluated on whole vectors. Other statements, such as calls of math
+    functions, are evaluated lane by lane. The block kernel must only be
+    called with full blocks, as the arguments are loaded for all cells.
+    Requires the scalar type to be double.
+    """
+
+    def __init__(self, L, block_size, tensor_size):
+        super().__init__(L, block_size, tensor_size)
+        self.num_block_cells = L.LiteralInt(block_size)
+
+        # Vector type and helpers from simd_declarations
+        self.vector_type = f"ffcx_double{block_size}"
+        self.load = L.Symbol(f"ffcx_load_double{block_size}")
+        self.broadcast = L.Symbol(f"ffcx_broadcast_double{block_size}")
+
+        # Local variables which are vectors
+        self.vector_variables = set()
+
+    def declare(self, typename, symbol, sizes, values=None, padlen=0):
+        if typename not in ("double", "ufc_scalar_t"):
+            return super().declare(typename, symbol, sizes, values=values, padlen=padlen)
+        self.cell_variables.add(symbol.name)
+        self.vector_variables.add(symbol.name)
+        if sizes:
+            return self.L.ArrayDecl(self.vector_type, symbol, sizes, values=values, padlen=padlen)
+        return self.L.VariableDecl(self.vector_type, symbol)
+
+    def vector_statement(self, s):
+        L = self.L
+        e = s.expr
+        if not isinstance(e, (L.Assign, L.AssignAdd, L.AssignSub, L.AssignMul, L.AssignDiv)):
+            return None
+        lhs = self.vector_expr(e.lhs)
+        rhs = self.vector_expr(e.rhs)
+        if lhs is None or rhs is None or isinstance(lhs, L.Call):
+            return None
+        if isinstance(e, L.Assign) and not self.depends_on_cell(e.rhs):
+            # Vectors can not be assigned scalars
+            rhs = L.Call(self.broadcast, rhs)
+        return L.Statement(type(e)(lhs, rhs))
+
+    def vector_expr(self, e):
+        """Return expression e evaluated for all cells of the block, or None."""
+        L = self.L
+        if isinstance(e, L.Symbol):
+            if e.name in self.vector_variables or not self.depends_on_cell(e):
+                return e
+            return None
+        elif isinstance(e, L.CExprTerminal):
+            return e
+        elif isinstance(e, L.ArrayAccess):
+            if any(self.depends_on_cell(i) for i in e.indices):
+                return None
+            name = e.array.name
+            if name == "A" and self.local_tensor is not None:
+                return self.local_tensor[e.indices]
+            elif name in self.vector_variables:
+                return e
+            elif name in ("w", "coordinate_dofs"):
+                index, = e.indices
+                return L.Call(self.load, L.AddressOf(e.array[index * self.num_cells + self.first_cell]))
+            elif name in self.cell_variables or name in cell_arguments:
+                return None
+            return e
+        elif isinstance(e, (L.Neg, L.Pos)):
+            arg = self.vector_expr(e.arg)
+            return None if arg is None else type(e)(arg)
+        elif isinstance(e, (L.Add, L.Sub, L.Mul, L.Div)):
+            lhs = self.vector_expr(e.lhs)
+            rhs = self.vector_expr(e.rhs)
+            return None if lhs is None or rhs is None else type(e)(lhs, rhs)
+        elif isinstance(e, (L.Sum, L.Product)):
+            args = [self.vector_expr(arg) for arg in e.args]
+            return None if any(arg is None for arg in args) else type(e)(args)
+        return None
@@ -22,6 +22,7 @@ from ffcx.codegeneration.finite_element import \
     generator as finite_element_generator
 from ffcx.codegeneration.form import generator as form_generator
 from ffcx.codegeneration.integrals import generator as integral_generator
+from ffcx.parallel import parallel_map
 
 logger = logging.getLogger("ffcx")
 
@@ -30,8 +31,11 @@ code_blocks = namedtuple("code_blocks", ["elements", "dofmaps",
                                          "forms", "expressions"])
 
 
-def generate_code(ir, parameters):
-    """Generate code blocks from intermediate representation."""
+def generate_code(ir, parameters, jobs=1):
+    """Generate code blocks from intermediate representation.
+
+    The integral code is generated in a pool of jobs processes if jobs > 1.
+    """
 
     logger.info(79 * "*")
     logger.info("Compiler stage 3: Generating code")
@@ -41,7 +45,8 @@ def generate_code(ir, parameters):
     code_finite_elements = [finite_element_generator(element_ir, parameters) for element_ir in ir.elements]
     code_dofmaps = [dofmap_generator(dofmap_ir, parameters) for dofmap_ir in ir.dofmaps]
     code_coordinate_mappings = [coordinate_mapping_generator(cmap_ir, parameters) for cmap_ir in ir.coordinate_mappings]
-    code_integrals = [integral_generator(integral_ir, parameters) for integral_ir in ir.integrals]
+    code_integrals = parallel_map(integral_generator, [(integral_ir, parameters) for integral_ir in ir.integrals],
+                                  jobs)
     code_forms = [form_generator(form_ir, parameters) for form_ir in ir.forms]
     code_expressions = [expression_generator(expression_ir, parameters) for expression_ir in ir.expressions]
 
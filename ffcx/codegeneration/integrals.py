@@ -8,9 +8,11 @@ import collections
 import itertools
 import logging
 
+import numpy
 import ufl
 from ffcx.codegeneration import integrals_template as ufc_integrals
 from ffcx.codegeneration.backend import FFCXBackend
+from ffcx.codegeneration.batching import CellBatcher, SIMDCellBatcher, default_block_size
 from ffcx.codegeneration.C.format_lines import format_indented_lines
 from ffcx.codegeneration.utils import apply_permutations_to_data
 from ffcx.ir.elementtables import piecewise_ttypes
@@ -18,6 +20,42 @@ from ffcx.ir.elementtables import piecewise_ttypes
 logger = logging.getLogger("ffcx")
 
 
+def upper_triangle_begin(rows, cols):
+    """Find the entries of a block in the upper triangle of the element tensor.
+
+    Entry (i, j) of the block is at (rows[i], cols[j]) in the element
+    tensor. Returns (offset, slope) such that the entry is in the upper
+    triangle if and only if j >= offset + slope * i, or None if the
+    entries in the upper triangle are not of this form.
+    """
+    num_cols = len(cols)
+    first = []
+    for row in rows:
+        upper = [col >= row for col in cols]
+        j = upper.index(True) if any(upper) else num_cols
+        if not all(upper[j:]):
+            return None
+        first.append(j)
+
+    rows_in_upper = [i for i, j in enumerate(first) if j < num_cols]
+    if not rows_in_upper:
+        return num_cols, 0
+    i0 = rows_in_upper[0]
+    slope = 0
+    if len(rows_in_upper) > 1:
+        i1 = rows_in_upper[1]
+        slope, remainder = divmod(first[i1] - first[i0], i1 - i0)
+        if remainder:
+            return None
+    offset = first[i0] - slope * i0
+
+    for i, j in enumerate(first):
+        begin = offset + slope * i
+        if begin != j and not (j == num_cols and begin >= num_cols):
+            return None
+    return offset, slope
+
+
 def generator(ir, parameters):
     logger.info("Generating code for integral:")
     logger.info(f"--- type: {ir.integral_type}")
@@ -76,20 +114,65 @@ def generator(ir, parameters):
     tabulate_tensor_fn = tabulate_tensor_declaration.format(
         factory_name=factory_name, tabulate_tensor=code["tabulate_tensor"])
 
-    # Format implementation code
+    # Generate the batched kernel if requested, unless element tables
+    # are permuted for each cell
+    tabulate_tensor_batch = "NULL"
+    tabulate_tensor_batch_declaration = ""
+    if (parameters["batch_kernels"] and integral_type in ufc_integrals.entity_local_index
+            and not ir.needs_permutation_data):
+        tensor_size = int(numpy.prod(ir.tensor_shape, dtype=int))
+        simd_width = parameters["simd_width"] if parameters["scalar_type"] == "double" else 0
+        if simd_width & (simd_width - 1):
+            raise RuntimeError(f"SIMD width {simd_width} is not a power of two.")
+        if simd_width > 0:
+            # Full blocks evaluate the cells in lockstep, and the
+            # remaining cells are looped over
+            block_size = simd_width
+            batchers = [("block", SIMDCellBatcher(backend.language, block_size, tensor_size)),
+                        ("tail", CellBatcher(backend.language, block_size, tensor_size))]
+            tail = "tail"
+            blocks = ufc_integrals.simd_declarations.format(
+                width=simd_width, size=8 * simd_width, lanes=", ".join(["(x)"] * simd_width))
+        else:
+            block_size = default_block_size
+            batchers = [("block", CellBatcher(backend.language, block_size, tensor_size))]
+            tail = "block"
+            blocks = ""
+        try:
+            for block, batcher in batchers:
+                batch_body = format_indented_lines(batcher.batch(parts).cs_format(ir.precision), 1)
+                if parameters["tabulate_tensor_void"]:
+                    batch_body = ""
+                blocks += ufc_integrals.tabulate_batch_block.format(
+                    factory_name=factory_name, block=block, tabulate_tensor=batch_body,
+                    entity_local_index=ufc_integrals.entity_local_index[integral_type])
+        except RuntimeError as e:
+            # The batched kernel is optional, and is left out for code
+            # the batcher cannot rewrite
+            logger.info(f"Not generating a batched kernel for {factory_name}: {e}")
+        else:
+            tabulate_tensor_fn += ufc_integrals.tabulate_batch_implementation.format(
+                factory_name=factory_name, blocks=blocks, block_size=block_size, tail=tail,
+                entity_local_index=ufc_integrals.entity_local_index[integral_type])
+            tabulate_tensor_batch = f"tabulate_tensor_batch_{factory_name}"
+            tabulate_tensor_batch_declaration = f"ufc_tabulate_tensor_batch {tabulate_tensor_batch};\n"
+
+    # Format implementation code, keeping the kernel separate from the
+    # factory so that it can be compiled as its own translation unit
+    kernel = ufc_integrals.kernel.format(tabulate_tensor=tabulate_tensor_fn)
     if integral_type == "custom":
         implementation = ufc_integrals.custom_factory.format(
             factory_name=factory_name,
             enabled_coefficients=code["enabled_coefficients"],
-            tabulate_tensor=tabulate_tensor_fn,
             needs_permutation_data=ir.needs_permutation_data)
     else:
         implementation = ufc_integrals.factory.format(
             factory_name=factory_name,
             enabled_coefficients=code["enabled_coefficients"],
-            tabulate_tensor=tabulate_tensor_fn,
+            tabulate_tensor_batch=tabulate_tensor_batch,
+            tabulate_tensor_batch_declaration=tabulate_tensor_batch_declaration,
             needs_permutation_data=ir.needs_permutation_data)
-    return declaration, implementation
+    return declaration, kernel, implementation
 
 
 class IntegralGenerator(object):
@@ -202,6 +285,7 @@ class IntegralGenerator(object):
         # quadloops
         all_preparts = []
         all_quadparts = []
+        all_postparts = []
 
         for rule in self.ir.integrand.keys():
             # Generate code to compute piecewise constant scalar factors
@@ -209,13 +293,33 @@ class IntegralGenerator(object):
 
             # Generate code to integrate reusable blocks of final
             # element tensor
-            preparts, quadparts = self.generate_quadrature_loop(rule)
+            preparts, quadparts, postparts = self.generate_quadrature_loop(rule)
             all_preparts += preparts
             all_quadparts += quadparts
+            all_postparts += postparts
+
+        # Only the upper triangle of symmetric element tensors is
+        # computed, and mirrored at the end. Until then the lower
+        # triangle holds the difference of the initial values of A, so
+        # that the kernel still adds to A.
+        mirror_parts = []
+        if self.ir.symmetric:
+            A = L.FlattenedArray(self.backend.symbols.element_tensor(), dims=self.ir.tensor_shape)
+            i = self.backend.symbols.argument_loop_index(0)
+            j = self.backend.symbols.argument_loop_index(1)
+            n = self.ir.tensor_shape[0]
+            parts += L.commented_code_list(
+                L.ForRange(i, 0, n, body=L.ForRange(j, i + 1, n, body=L.AssignSub(A[j, i], A[i, j]))),
+                "Initial values of the lower triangle of the symmetric element tensor")
+            mirror_parts = L.commented_code_list(
+                L.ForRange(i, 0, n, body=L.ForRange(j, i + 1, n, body=L.AssignAdd(A[j, i], A[i, j]))),
+                "Mirror the upper triangle of the symmetric element tensor")
 
         # Collect parts before, during, and after quadrature loops
         parts += all_preparts
         parts += all_quadparts
+        parts += all_postparts
+        parts += mirror_parts
 
         return L.StatementList(parts)
 
@@ -236,6 +340,11 @@ class IntegralGenerator(object):
         # Loop over quadrature rules
         for quadrature_rule, integrand in self.ir.integrand.items():
 
+            # Weights are not needed if all blocks are preintegrated
+            blocks = itertools.chain.from_iterable(integrand["block_contributions"].values())
+            if all(blockdata.name is not None for blockdata in blocks):
+                continue
+
             num_points = quadrature_rule.weights.shape[0]
             # Generate quadrature weights array
             wsym = self.backend.symbols.weights_table(quadrature_rule)
@@ -293,13 +402,22 @@ class IntegralGenerator(object):
         out = [L.ArrayDecl(
             "double", name, table.shape, table, padlen=padlen)]
 
-        dummy_vars = tuple(0 if j == 1 else L.Symbol(f"i{i}") for i, j in enumerate(table.shape[:-1]))
-        ranges = tuple((dummy_vars[i], 0, j) for i, j in enumerate(table.shape[:-1]) if j != 1)
-        apply_perms = apply_permutations_to_data(
-            L, self.ir.table_dof_base_permutations[name], self.ir.cell_shape, L.Symbol(name),
-            indices=lambda dof: dummy_vars + (dof, ), ranges=ranges)
-        if len(apply_perms) > 0:
-            out += ["{"] + apply_perms + ["}"]
+        # Preintegrated tables have a dof dimension for each argument,
+        # with the permutations of its table
+        if self.ir.unique_table_types[name] == "preintegrated":
+            base_permutations = self.ir.table_dof_base_permutations[name]
+        else:
+            base_permutations = (self.ir.table_dof_base_permutations[name], )
+
+        dummy_vars = tuple(0 if j == 1 else L.Symbol(f"i{i}") for i, j in enumerate(table.shape))
+        for k, perms in enumerate(base_permutations):
+            axis = table.ndim - len(base_permutations) + k
+            ranges = tuple((dummy_vars[i], 0, j) for i, j in enumerate(table.shape) if j != 1 and i != axis)
+            apply_perms = apply_permutations_to_data(
+                L, perms, self.ir.cell_shape, L.Symbol(name),
+                indices=lambda dof, axis=axis: dummy_vars[:axis] + (dof, ) + dummy_vars[axis + 1:], ranges=ranges)
+            if len(apply_perms) > 0:
+                out += ["{"] + apply_perms + ["}"]
         return out
 
     def generate_quadrature_loop(self, quadrature_rule):
@@ -313,7 +431,7 @@ class IntegralGenerator(object):
 
         # Generate dofblock parts, some of this will be placed before or
         # after quadloop
-        preparts, quadparts = \
+        preparts, quadparts, postparts = \
             self.generate_dofblock_partition(quadrature_rule)
         body += quadparts
 
@@ -327,7 +445,7 @@ class IntegralGenerator(object):
             iq = self.backend.symbols.quadrature_loop_index()
             quadparts = [L.ForRange(iq, 0, num_points, body=body)]
 
-        return preparts, quadparts
+        return preparts, quadparts, postparts
 
     def generate_piecewise_partition(self, quadrature_rule):
         L = self.backend.language
@@ -447,6 +565,7 @@ class IntegralGenerator(object):
         block_contributions = self.ir.integrand[quadrature_rule]["block_contributions"]
         preparts = []
         quadparts = []
+        postparts = []
         blocks = [(blockmap, blockdata)
                   for blockmap, contributions in sorted(block_contributions.items())
                   for blockdata in contributions]
@@ -454,7 +573,7 @@ class IntegralGenerator(object):
         for blockmap, blockdata in blocks:
 
             # Define code for block depending on mode
-            block_preparts, block_quadparts = \
+            block_preparts, block_quadparts, block_postparts = \
                 self.generate_block_parts(quadrature_rule, blockmap, blockdata)
 
             # Add definitions
@@ -463,7 +582,10 @@ class IntegralGenerator(object):
             # Add computations
             quadparts.extend(block_quadparts)
 
-        return preparts, quadparts
+            # Add computations after the quadrature loop
+            postparts.extend(block_postparts)
+
+        return preparts, quadparts, postparts
 
     def get_entities(self, blockdata):
         L = self.backend.language
@@ -506,6 +628,17 @@ class IntegralGenerator(object):
             return tuple(perms)
 
     def get_arg_factors(self, blockdata, block_rank, quadrature_rule, iq, indices):
+        if blockdata.name is not None:
+            # The arguments of preintegrated blocks are in a single
+            # table, which may be shared with the transposed block
+            L = self.backend.language
+            entity = self.get_entities(blockdata)[0]
+            indices = tuple(indices)
+            if blockdata.transposed:
+                indices = indices[::-1]
+            return [L.Symbol(blockdata.name)[(0, entity) + indices]]
+
+        assert not blockdata.transposed
         arg_factors = []
         for i in range(block_rank):
             mad = blockdata.ma_data[i]
@@ -551,6 +684,14 @@ class IntegralGenerator(object):
         if "zeros" in ttypes:
             raise RuntimeError("Not expecting zero arguments to be left in dofblock generation.")
 
+        # Only the entries in the upper triangle of symmetric element
+        # tensors are computed
+        upper = None
+        if self.ir.symmetric:
+            if min(blockmap[0]) > max(blockmap[1]):
+                return [], [], []
+            upper = upper_triangle_begin(*blockmap)
+
         iq = self.backend.symbols.quadrature_loop_index()
 
         # Override dof index with quadrature loop index for arguments
@@ -582,12 +723,21 @@ class IntegralGenerator(object):
             weight = weights[iq]
 
         # Define fw = f * weight
-        assert not blockdata.transposed, "Not handled yet"
-
         fw_rhs = L.float_product([f, weight])
-        if not isinstance(fw_rhs, L.Product):
+        if blockdata.sum_factorization is not None:
+            return self.generate_sum_factorized_block_parts(quadrature_rule, blockmap, blockdata,
+                                                            factor_index, fw_rhs, upper)
+
+        if blockdata.name is not None:
+            # Preintegrated block, A += f * PI before the quadrature
+            # loop where PI is the integral of weight * u * v
+            fw = f
+            parts = preparts
+        elif not isinstance(fw_rhs, L.Product):
             fw = fw_rhs
+            parts = quadparts
         else:
+            parts = quadparts
             # Define and cache scalar temp variable
             key = (quadrature_rule, factor_index, blockdata.all_factors_piecewise)
             fw, defined = self.get_temp_symbol("fw", key)
@@ -596,7 +746,6 @@ class IntegralGenerator(object):
 
         # Naively accumulate integrand for this block in the innermost
         # loop
-        assert not blockdata.transposed
         A_shape = self.ir.tensor_shape
 
         Asym = self.backend.symbols.element_tensor()
@@ -612,13 +761,17 @@ class IntegralGenerator(object):
             else:
                 continue
             break
+        if self.ir.symmetric and upper is None:
+            expand_loop = True
 
         if expand_loop:
             # If DOFs in dofrange are not equally spaced, then expand
             # out the for loop
             for A_indices, B_indices in zip(itertools.product(*blockmap),
                                             itertools.product(*[range(len(b)) for b in blockmap])):
-                quadparts += [
+                if self.ir.symmetric and A_indices[0] > A_indices[1]:
+                    continue
+                parts += [
                     L.AssignAdd(
                         A[A_indices],
                         L.float_product([fw] + self.get_arg_factors(
@@ -645,8 +798,117 @@ class IntegralGenerator(object):
 
             body = L.AssignAdd(A[A_indices], B_rhs)
 
+            begins = [0] * block_rank
+            if upper is not None:
+                offset, slope = upper
+                begins[1] = slope * B_indices[0] + offset
             for i in reversed(range(block_rank)):
-                body = L.ForRange(B_indices[i], 0, blockdims[i], body=body)
-            quadparts += [body]
+                body = L.ForRange(B_indices[i], begins[i], blockdims[i], body=body)
+            parts += [body]
+
+        return preparts, quadparts, []
+
+    def generate_sum_factorized_block_parts(self, quadrature_rule, blockmap, blockdata, factor_index, fw_rhs,
+                                            upper=None):
+        """Generate code parts for a block by sum factorization.
+
+        The integrand times the weight is stored for each quadrature
+        point in the quadrature loop. After the loop, it is contracted
+        with the 1D tables of the arguments one direction of the tensor
+        product grid of points at a time. The contraction in the first
+        direction adds directly to the element tensor, so no temporary
+        is as large as the block, and the temporaries of each block are
+        declared in their own scope. For symmetric element tensors, only
+        the entries in the upper triangle are added, from column
+        offset + slope * row of the block for upper = (offset, slope).
+        """
+        L = self.backend.language
+        symbols = self.backend.symbols
+        sf = blockdata.sum_factorization
+
+        preparts = []
+        quadparts = []
+        postparts = []
+
+        rank = len(blockmap)
+        tdim = sf.points.ndim
+        num_points = sf.points.shape
+        num_functions = [[self.ir.unique_tables[name].shape[-1] for name in names] for names in sf.factors]
+
+        # Store fw = f * weight at each point
+        key = (quadrature_rule, factor_index, blockdata.all_factors_piecewise)
+        fwq, defined = self.get_temp_symbol("fwq", key)
+        if not defined:
+            iq = symbols.quadrature_loop_index()
+            preparts.append(L.ArrayDecl("ufc_scalar_t", fwq, sf.points.size))
+            quadparts.append(L.Assign(fwq[iq], fw_rhs))
+
+        # Index of the point at each position of the grid
+        grid, defined = self.get_temp_symbol("grid", (quadrature_rule, ))
+        if not defined:
+            preparts.append(L.ArrayDecl("static const int", grid, num_points, sf.points))
+
+        # Contract with the 1D tables in the last direction first, so
+        # that t[q0]...[q(d-1)][i(d)][j(d)]...[i(tdim-1)][j(tdim-1)] is
+        # the sum over the points in directions d and above
+        q = [symbols.quadrature_grid_index(d) for d in range(tdim)]
+        a = [[symbols.argument_grid_index(r, d) for d in range(tdim)] for r in range(rank)]
+        t_prev = None
+        for d in reversed(range(1, tdim)):
+            t = self.new_temp_symbol("sf")
+            a_indices = [a[r][m] for m in range(d, tdim) for r in range(rank)]
+            a_sizes = [num_functions[r][m] for m in range(d, tdim) for r in range(rank)]
+            postparts.append(L.ArrayDecl("ufc_scalar_t", t, num_points[:d] + tuple(a_sizes), values=0))
+
+            if t_prev is None:
+                t_prev_access = fwq[grid[q]]
+            else:
+                t_prev_access = t_prev[q[:d + 1] + a_indices[rank:]]
+            factors = [L.Symbol(sf.factors[r][d])[0][0][q[d]][a[r][d]] for r in range(rank)]
+            body = L.AssignAdd(t[q[:d] + a_indices], L.float_product(factors + [t_prev_access]))
+
+            ranges = [(q[m], 0, num_points[m]) for m in range(d + 1)]
+            ranges += [(index, 0, size) for index, size in zip(a_indices, a_sizes)]
+            postparts.append(L.ForRanges(*ranges, body=body))
+            t_prev = t
+
+        # Add the sums to the element tensor, with the scales of the dofs
+        A = L.FlattenedArray(symbols.element_tensor(), dims=self.ir.tensor_shape)
+        tables = []
+        for r in range(rank):
+            key = (blockdata.unames[r], blockmap[r])
+            dofs, defined = self.get_temp_symbol("dofs", key)
+            positions, defined = self.get_temp_symbol("positions", key)
+            scale, defined = self.get_temp_symbol("scales", key)
+            if not defined:
+                preparts += [L.ArrayDecl("static const int", dofs, len(blockmap[r]), blockmap[r]),
+                             L.ArrayDecl("static const int", positions, sf.positions[r].shape, sf.positions[r]),
+                             L.ArrayDecl("static const double", scale, len(blockmap[r]), sf.scales[r])]
+            tables.append((dofs, positions, scale))
+
+        def add_entry(indices):
+            # The contraction in the first direction, for one entry of
+            # the block
+            A_indices = [dofs[index] for index, (dofs, positions, scale) in zip(indices, tables)]
+            t_indices = [q[0]] + [positions[index][d] for d in range(1, tdim)
+                                  for index, (dofs, positions, scale) in zip(indices, tables)]
+            scales = [scale[index] for index, (dofs, positions, scale) in zip(indices, tables)]
+            factors = [L.Symbol(sf.factors[r][0])[0][0][q[0]][positions[index][0]]
+                       for r, (index, (dofs, positions, scale)) in enumerate(zip(indices, tables))]
+            body = L.AssignAdd(A[A_indices], L.float_product(scales + factors + [t_prev[t_indices]]))
+            return L.ForRange(q[0], 0, num_points[0], body=body)
+
+        arg_indices = [symbols.argument_loop_index(r) for r in range(rank)]
+        ranges = [(index, 0, len(bm)) for index, bm in zip(arg_indices, blockmap)]
+        if upper is not None:
+            offset, slope = upper
+            ranges[1] = (arg_indices[1], slope * arg_indices[0] + offset, len(blockmap[1]))
+        if self.ir.symmetric and upper is None:
+            # Add the entries in the upper triangle one by one
+            postparts += [add_entry(indices) for indices in itertools.product(*[range(len(bm)) for bm in blockmap])
+                          if blockmap[0][indices[0]] <= blockmap[1][indices[1]]]
+        else:
+            postparts.append(L.ForRanges(*ranges, body=add_entry(arg_indices)))
 
-        return preparts, quadparts
+        postparts = L.commented_code_list(L.Scope(postparts), "Sum factorization of block")
+        return preparts, quadparts, postparts
@@ -80,11 +80,73 @@ void tabulate_tensor_{factory_name}(ufc_scalar_t* restrict A,
 """
 }
 
-factory = """
-// Code for integral {factory_name}
+tabulate_batch_block = """
+static inline void tabulate_tensor_batch_{factory_name}_{block}(int num_cells, int first_cell, int num_block_cells,
+                                    ufc_scalar_t* restrict A,
+                                    const ufc_scalar_t* restrict w,
+                                    const ufc_scalar_t* restrict c,
+                                    const double* restrict coordinate_dofs,
+                                    const int* restrict {entity_local_index},
+                                    const uint8_t* restrict quadrature_permutation,
+                                    const uint32_t* restrict cell_permutation)
+{{
+{tabulate_tensor}
+}}
+"""
 
+tabulate_batch_implementation = """{blocks}
+void tabulate_tensor_batch_{factory_name}(int num_cells,
+                                    ufc_scalar_t* restrict A,
+                                    const ufc_scalar_t* restrict w,
+                                    const ufc_scalar_t* restrict c,
+                                    const double* restrict coordinate_dofs,
+                                    const int* restrict {entity_local_index},
+                                    const uint8_t* restrict quadrature_permutation,
+                                    const uint32_t* restrict cell_permutation)
+{{
+  // Full blocks pass a constant block size, for which the cell loops
+  // of the inlined block kernel are specialized
+  int first_cell = 0;
+  for (; first_cell + {block_size} <= num_cells; first_cell += {block_size})
+    tabulate_tensor_batch_{factory_name}_block(num_cells, first_cell, {block_size}, A, w, c, coordinate_dofs,
+                                         {entity_local_index}, quadrature_permutation, cell_permutation);
+  if (first_cell < num_cells)
+    tabulate_tensor_batch_{factory_name}_{tail}(num_cells, first_cell, num_cells - first_cell, A, w, c, coordinate_dofs,
+                                         {entity_local_index}, quadrature_permutation, cell_permutation);
+}}
+"""
+
+# GCC vector extension types of the batched kernels evaluating cells
+# in lockstep, and macros for unaligned loads of the kernel arguments.
+# Macros avoid passing vectors to functions, which changes the ABI
+# depending on the instruction set.
+simd_declarations = """
+#ifndef FFCX_DOUBLE{width}
+#define FFCX_DOUBLE{width}
+typedef double ffcx_double{width} __attribute__((vector_size({size})));
+typedef double ffcx_double{width}_unaligned __attribute__((vector_size({size}), aligned(sizeof(double))));
+#define ffcx_load_double{width}(p) (*(const ffcx_double{width}_unaligned*)(p))
+#define ffcx_broadcast_double{width}(x) ((ffcx_double{width}){{ {lanes} }})
+#endif
+"""
+
+# Name of the entity_local_index argument of the kernels
+entity_local_index = {
+    "cell": "unused_local_index",
+    "exterior_facet": "facet",
+    "interior_facet": "facet",
+    "vertex": "vertex"
+}
+
+kernel = """
 {tabulate_tensor}
+"""
+
+factory = """
+// Code for integral {factory_name}
 
+ufc_tabulate_tensor tabulate_tensor_{factory_name};
+{tabulate_tensor_batch_declaration}
 ufc_integral* create_{factory_name}(void)
 {{
   static const bool enabled{enabled_coefficients}
@@ -92,6 +154,7 @@ ufc_integral* create_{factory_name}(void)
   integral->enabled_coefficients = enabled;
   integral->tabulate_tensor = tabulate_tensor_{factory_name};
   integral->needs_permutation_data = {needs_permutation_data};
+  integral->tabulate_tensor_batch = {tabulate_tensor_batch};
   return integral;
 }}
 
@@ -101,7 +164,7 @@ ufc_integral* create_{factory_name}(void)
 custom_factory = """
 // Code for custom integral {factory_name}
 
-{tabulate_tensor}
+ufc_tabulate_tensor_custom tabulate_tensor_{factory_name};
 
 ufc_custom_integral* create_{factory_name}(void)
 {{
@@ -4,13 +4,23 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
-from contextlib import redirect_stdout
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import hashlib
 import importlib
 import io
+import json
 import logging
 import os
 import re
+import shutil
+import socket
+import sys
+import tarfile
 import tempfile
+import threading
 import time
 from pathlib import Path
 
@@ -18,6 +28,11 @@ import cffi
 import ffcx
 import ffcx.naming
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 logger = logging.getLogger("ffcx")
 
 # Get declarations directly from ufc.h
@@ -39,57 +54,629 @@ UFC_FORM_DECL = '\n'.join(re.findall('typedef struct ufc_form.*?ufc_form;', ufc_
 
 UFC_INTEGRAL_DECL = '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_tensor\).*?\);', ufc_h, re.DOTALL))
 UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_tensor_custom\).*?\);', ufc_h, re.DOTALL))
+UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_tensor_batch\).*?\);', ufc_h, re.DOTALL))
 UFC_INTEGRAL_DECL += '\n'.join(re.findall('typedef struct ufc_integral.*?ufc_integral;',
                                           ufc_h, re.DOTALL))
 UFC_INTEGRAL_DECL += '\n'.join(re.findall('typedef struct ufc_custom_integral.*?ufc_custom_integral;',
                                           ufc_h, re.DOTALL))
 UFC_EXPRESSION_DECL = '\n'.join(re.findall('typedef struct ufc_expression.*?ufc_expression;', ufc_h, re.DOTALL))
 
+# Matches the names of the kernels defined in an integral kernel
+# translation unit
+_kernel_name = re.compile(r"^void (tabulate_tensor_\w+)\(", re.MULTILINE)
+
+# In-process registry of loaded JIT modules, in least-recently-used
+# order. Maps (module name, cache directory) to (objects, module).
+_module_registry = collections.OrderedDict()
+_module_registry_size = 128
+_module_registry_lock = threading.RLock()
+
+# Directories of loaded bundles of precompiled modules, with the names
+# of the modules they contain
+_bundles = []
+_bundles_lock = threading.Lock()
+
+# Executor for background compilation, created on first use
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def set_module_registry_size(size):
+    """Set the maximum number of loaded JIT modules kept in the in-process registry.
+
+    Least recently used modules are evicted first. A size of 0 disables
+    the registry.
+    """
+    global _module_registry_size
+    if size < 0:
+        raise ValueError(f"Registry size must be non-negative, not {size}.")
+    with _module_registry_lock:
+        _module_registry_size = size
+        while len(_module_registry) > _module_registry_size:
+            _module_registry.popitem(last=False)
+
+
+def clear_module_registry():
+    """Remove all modules from the in-process registry."""
+    with _module_registry_lock:
+        _module_registry.clear()
+
+
+def _registry_key(module_name, cache_dir):
+    return (module_name, None if cache_dir is None else str(Path(cache_dir).resolve()))
+
+
+def _registry_get(key):
+    """Return registered (objects, module) for key, or None."""
+    with _module_registry_lock:
+        try:
+            entry = _module_registry[key]
+        except KeyError:
+            return None
+        _module_registry.move_to_end(key)
+    logger.info(f"Reusing loaded JIT module {key[0]}")
+    return entry
+
+
+def _registry_put(key, objects, module):
+    with _module_registry_lock:
+        if _module_registry_size == 0:
+            return
+        _module_registry[key] = (objects, module)
+        _module_registry.move_to_end(key)
+        while len(_module_registry) > _module_registry_size:
+            _module_registry.popitem(last=False)
+
+
+class _ThreadStdout:
+    """Stand-in for sys.stdout which sends the output of capturing threads to their own buffers."""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.targets = {}
+
+    def _target(self):
+        return self.targets.get(threading.get_ident(), self.stdout)
+
+    def write(self, s):
+        return self._target().write(s)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
+
+
+_stdout_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _capture_stdout(f):
+    """Redirect sys.stdout to f in the calling thread only.
+
+    Unlike contextlib.redirect_stdout, output of other threads (e.g.
+    the application while compiling in the background) is unaffected.
+    """
+    ident = threading.get_ident()
+    with _stdout_lock:
+        if not isinstance(sys.stdout, _ThreadStdout):
+            sys.stdout = _ThreadStdout(sys.stdout)
+        router = sys.stdout
+        router.targets[ident] = f
+    try:
+        yield f
+    finally:
+        with _stdout_lock:
+            del router.targets[ident]
+            if not router.targets and sys.stdout is router:
+                sys.stdout = router.stdout
+
 
 def _compute_parameter_signature(parameters):
     """Return parameters signature (some parameters should not affect signature)."""
     return str(sorted(parameters.items()))
 
 
-def get_cached_module(module_name, object_names, cache_dir, timeout):
-    """Look for an existing C file and wait for compilation, or if it does not exist, create it."""
+class _FileLock:
+    """Exclusive advisory lock on a file, waited for with exponential backoff.
+
+    With fcntl available the lock is released by the operating system
+    when the holding process exits, so a crashed compilation never
+    leaves a stale lock behind. Otherwise the lock file records the host
+    and process holding it, and a lock left by a process of this host
+    which no longer runs is removed.
+    """
+
+    # Initial and maximum wait (seconds) between attempts to take the lock
+    initial_delay = 0.001
+    max_delay = 0.25
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._fd = None
+
+    def acquire(self, timeout):
+        """Take the lock, raising TimeoutError after timeout seconds."""
+        deadline = time.monotonic() + timeout
+        delay = self.initial_delay
+        while not self._try_acquire():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Timed out waiting for lock {self.path}")
+            time.sleep(min(delay, remaining))
+            delay = min(2 * delay, self.max_delay)
+
+    def _try_acquire(self):
+        if fcntl is None:
+            # Without fcntl, existence of the lock file is the lock
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                if self._is_stale():
+                    logger.info(f"Removing stale lock {self.path}")
+                    try:
+                        os.unlink(self.path)
+                    except FileNotFoundError:
+                        pass
+                return False
+            os.write(fd, f"{socket.gethostname()} {os.getpid()}".encode())
+            self._fd = fd
+            return True
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # The lock file may have been removed by cache pruning
+            # after it was opened here
+            locked = os.fstat(fd).st_ino == os.stat(self.path).st_ino
+        except OSError:
+            locked = False
+        if not locked:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def _is_stale(self):
+        """Check if the lock file was left by a process of this host which has exited."""
+        try:
+            with open(self.path) as f:
+                host, pid = f.read().split()
+            pid = int(pid)
+        except (OSError, ValueError):
+            # Gone, or not written yet
+            return False
+        return host == socket.gethostname() and not _process_exists(pid)
+
+    def release(self, remove=False):
+        """Release the lock, and with remove=True delete the lock file."""
+        if self._fd is None:
+            return
+        if fcntl is None:
+            os.close(self._fd)
+            os.unlink(self.path)
+        else:
+            if remove:
+                os.unlink(self.path)
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
+
+
+def _process_exists(pid):
+    """Check if a process with the given id runs on this host."""
+    if os.name == "nt":
+        # os.kill terminates processes on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            # Access is denied for processes of other users
+            return kernel32.GetLastError() == 5
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_cached_module(module_name, object_names, cache_dir, timeout, local_cache_dir=None):
+    """Look for a compiled module in the cache, waiting for a concurrent compilation if needed.
+
+    Returns (objects, module) if the module is available in cache_dir,
+    with the objects created on first access, and (None, None) otherwise.
+    """
+    with _lock_cached_module(module_name, object_names, cache_dir, timeout, local_cache_dir) as (obj, module):
+        return obj, module
+
+
+@contextlib.contextmanager
+def _lock_cached_module(module_name, object_names, cache_dir, timeout, local_cache_dir=None):
+    """Look for a compiled module in the cache, taking its compilation lock if it is missing.
+
+    Yields (objects, module) if the module is available in cache_dir,
+    with the objects created on first access.
+    Otherwise yields (None, None), and the caller holds the compilation
+    lock for this module until the end of the with-block.
+
+    Waiters poll a lock file with exponential backoff, so they resume as
+    soon as the compiling process finishes. If the compiling process
+    dies, its lock is released and a waiter compiles the module instead.
+
+    If local_cache_dir is given, it is consulted first, and modules
+    found in cache_dir are copied there and loaded from the copy. Once
+    a module is in the local cache, loading it does not touch cache_dir.
+    """
     cache_dir = Path(cache_dir)
     c_filename = cache_dir.joinpath(module_name).with_suffix(".c")
     ready_name = c_filename.with_suffix(".c.cached")
+    failed_name = c_filename.with_suffix(".c.failed")
+
+    if local_cache_dir is None:
+        load_dir = cache_dir
+    else:
+        load_dir = Path(local_cache_dir)
+        local_ready_name = load_dir.joinpath(module_name + ".c.cached")
+        if local_ready_name.exists():
+            _touch(local_ready_name)
+            _record_cache_stats(load_dir, module_hits=1)
+            yield _load_objects(load_dir, module_name, object_names)
+            return
+
+    # Fast path, module compiled already
+    if ready_name.exists():
+        _touch(ready_name)
+        _copy_module(cache_dir, load_dir, module_name)
+        _record_cache_stats(load_dir, module_hits=1)
+        yield _load_objects(load_dir, module_name, object_names)
+        return
 
     # Ensure cache dir exists
     cache_dir.mkdir(exist_ok=True, parents=True)
 
+    failed_mtime = _mtime(failed_name)
+    lock = _FileLock(c_filename.with_suffix(".c.lock"))
+    try:
+        lock.acquire(timeout)
+    except TimeoutError:
+        raise TimeoutError(f"""JIT compilation timed out waiting for another process to compile {c_filename}.
+        Try cleaning cache (e.g. remove {lock.path}) or increase timeout parameter.""")
+
+    try:
+        if ready_name.exists():
+            logger.info(f"Module compiled by another process: {c_filename}")
+            _copy_module(cache_dir, load_dir, module_name)
+            _record_cache_stats(load_dir, module_hits=1)
+            yield _load_objects(load_dir, module_name, object_names)
+        elif _mtime(failed_name) != failed_mtime:
+            raise RuntimeError(f"JIT compilation failed in another process, see {failed_name}")
+        else:
+            if c_filename.exists():
+                logger.info(f"Recompiling after interrupted compilation: {c_filename}")
+            yield None, None
+    finally:
+        lock.release()
+
+
+def _copy_module(src_dir, dst_dir, module_name):
+    """Copy a compiled module between cache tiers, publishing each file atomically.
+
+    The ready file is copied last, so a module is never seen as
+    available before its library is in place.
+    """
+    if src_dir == dst_dir:
+        return
+    dst_dir.mkdir(exist_ok=True, parents=True)
+    library = module_name + importlib.machinery.EXTENSION_SUFFIXES[0]
+    for filename in (library, module_name + ".c.cached"):
+        tmp_name = dst_dir.joinpath(f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.copyfile(src_dir.joinpath(filename), tmp_name)
+        os.replace(tmp_name, dst_dir.joinpath(filename))
+
+
+def _touch(path):
+    """Record use of a cache file, for least-recently-used eviction."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _read_cache_stats(stats_name):
+    try:
+        with open(stats_name) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _record_cache_stats(cache_dir, **counts):
+    """Add hit and miss counts to the statistics kept in cache_dir."""
+    stats_name = Path(cache_dir).joinpath("stats.json")
+    lock = _FileLock(stats_name.with_suffix(".json.lock"))
+    try:
+        lock.acquire(timeout=1)
+    except (TimeoutError, OSError):
+        logger.debug(f"Unable to update JIT cache statistics in {stats_name}")
+        return
+
+    try:
+        stats = _read_cache_stats(stats_name)
+        for name, count in counts.items():
+            stats[name] = stats.get(name, 0) + count
+        tmp_name = stats_name.with_suffix(".json.tmp")
+        tmp_name.write_text(json.dumps(stats))
+        os.replace(tmp_name, stats_name)
+    finally:
+        lock.release()
+
+
+_CacheEntry = collections.namedtuple("_CacheEntry", ["kind", "files", "size", "last_access", "lock"])
+
+
+def _cache_entries(cache_dir):
+    """Return the modules, kernel objects and IR in cache_dir as a list of _CacheEntry.
+
+    Lock files, statistics and temporary files of compilations in
+    progress are not part of any entry.
+    """
+    cache_dir = Path(cache_dir)
+    groups = collections.defaultdict(list)
+    for path in cache_dir.glob("libffcx_*"):
+        if path.suffix != ".lock":
+            groups[("module", path.name.split(".")[0])].append(path)
+    for path in cache_dir.joinpath("objects").glob("*"):
+        if not path.name.startswith("tmp"):
+            groups[("object", path.name.split(".")[0])].append(path)
+    for path in cache_dir.joinpath("ir").glob("*.pickle"):
+        groups[("ir", path.stem)].append(path)
+
+    entries = []
+    for (kind, name), files in groups.items():
+        size = 0
+        last_access = 0
+        for path in files:
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            size += st.st_size
+            last_access = max(last_access, st.st_mtime)
+        lock = cache_dir.joinpath(name + ".c.lock") if kind == "module" else None
+        entries.append(_CacheEntry(kind, files, size, last_access, lock))
+    return entries
+
+
+def cache_stats(cache_dir):
+    """Return statistics for a JIT cache directory.
+
+    Returns a dict with the number of cached modules, kernel objects and
+    intermediate representations, their total size in bytes, and the numbers of cache hits and misses
+    recorded by the JIT compiler.
+    """
+    cache_dir = Path(cache_dir)
+    entries = _cache_entries(cache_dir)
+    stats = {"modules": sum(1 for e in entries if e.kind == "module"),
+             "objects": sum(1 for e in entries if e.kind == "object"),
+             "ir": sum(1 for e in entries if e.kind == "ir"),
+             "bytes": sum(e.size for e in entries)}
+    for name in ("module_hits", "module_misses", "object_hits", "object_misses"):
+        stats[name] = 0
+    stats.update(_read_cache_stats(cache_dir.joinpath("stats.json")))
+    return stats
+
+
+def prune_cache(cache_dir, max_size=None, max_age=None):
+    """Evict least recently used modules, kernel objects and IR from a JIT cache directory.
+
+    Entries not used for more than max_age seconds are removed, then
+    the least recently used entries are removed until the cache holds
+    at most max_size bytes. Modules being compiled by another process
+    are skipped. The lock files of modules which are no longer cached
+    are removed unless they are held.
+
+    Returns the number of bytes removed.
+    """
+    entries = sorted(_cache_entries(cache_dir), key=lambda e: e.last_access)
+    total = sum(e.size for e in entries)
+    now = time.time()
+    removed = 0
+    for entry in entries:
+        expired = max_age is not None and now - entry.last_access > max_age
+        oversized = max_size is not None and total > max_size
+        if not (expired or oversized):
+            # Remaining entries are more recent and fit
+            break
+
+        lock = None
+        if entry.lock is not None and entry.lock.exists():
+            lock = _FileLock(entry.lock)
+            try:
+                lock.acquire(timeout=0)
+            except TimeoutError:
+                logger.info(f"Not evicting {entry.files[0]}, compilation in progress")
+                continue
+        try:
+            for path in entry.files:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+        finally:
+            if lock is not None:
+                lock.release(remove=True)
+
+        total -= entry.size
+        removed += entry.size
+        logger.info(f"Evicted {entry.files[0].name.split('.')[0]} ({entry.size} bytes)")
+
+    # Lock files left by compilations which failed or were interrupted
+    for path in Path(cache_dir).glob("libffcx_*.c.lock"):
+        if path.with_suffix(".cached").exists():
+            continue
+        lock = _FileLock(path)
+        try:
+            lock.acquire(timeout=0)
+        except (TimeoutError, OSError):
+            continue
+        lock.release(remove=True)
+
+    return removed
+
+
+def clear_cache(cache_dir):
+    """Remove all modules, kernel objects, IR, statistics and lock files from a JIT cache directory.
+
+    Returns the number of bytes removed.
+    """
+    removed = prune_cache(cache_dir, max_size=0)
+    stats_name = Path(cache_dir).joinpath("stats.json")
+    lock = _FileLock(stats_name.with_suffix(".json.lock"))
+    try:
+        lock.acquire(timeout=1)
+    except (TimeoutError, OSError):
+        logger.info(f"Not removing {stats_name}, statistics are being updated")
+        return removed
+    try:
+        if stats_name.exists():
+            stats_name.unlink()
+    finally:
+        lock.release(remove=True)
+    return removed
+
+
+def create_bundle(path, cache_dir):
+    """Write the modules compiled in a JIT cache directory to a bundle archive.
+
+    The archive (a gzipped tarball) holds the shared libraries and an
+    index of module names. It can be copied to other machines with the
+    same Python and FFCX versions and passed to load_bundle there.
+
+    Returns the names of the bundled modules.
+    """
+    cache_dir = Path(cache_dir)
+    modules = {}
+    for ready_name in sorted(cache_dir.glob("libffcx_*.c.cached")):
+        module_name = ready_name.name[:-len(".c.cached")]
+        for suffix in importlib.machinery.EXTENSION_SUFFIXES:
+            library = cache_dir.joinpath(module_name + suffix)
+            if library.exists():
+                modules[module_name] = library.name
+                break
+
+    index = {"ffcx_version": ffcx.__version__,
+             "extension_suffix": importlib.machinery.EXTENSION_SUFFIXES[0],
+             "modules": modules}
+    index_data = json.dumps(index, indent=1).encode("utf-8")
+
+    with tarfile.open(path, "w:gz") as tar:
+        for library in modules.values():
+            tar.add(cache_dir.joinpath(library), arcname=library)
+        info = tarfile.TarInfo("index.json")
+        info.size = len(index_data)
+        info.mtime = time.time()
+        tar.addfile(info, io.BytesIO(index_data))
+
+    return list(modules)
+
+
+def load_bundle(path, extract_dir=None):
+    """Use a bundle of precompiled modules as a read-only cache layer.
+
+    Modules in the bundle are loaded from it by the compile_* functions,
+    before looking in (or compiling into) their cache_dir. The bundle
+    is never written to.
+
+    Parameters
+    ----------
+    path
+        Bundle archive written by create_bundle (or ``ffcx bundle``), or
+        a directory into which one has been extracted.
+    extract_dir
+        Directory to extract the archive to. Defaults to a directory in
+        the system temporary directory, named after the archive. An
+        existing extraction is reused.
+
+    Returns the number of modules made available.
+
+    """
+    path = Path(path)
+    if path.is_dir():
+        directory = path
+    else:
+        if extract_dir is None:
+            st = path.stat()
+            key = hashlib.sha1(f"{path.resolve()}:{st.st_size}:{st.st_mtime_ns}".encode("utf-8")).hexdigest()
+            extract_dir = Path(tempfile.gettempdir()).joinpath(f"ffcx-bundle-{key}")
+        directory = Path(extract_dir)
+        if not directory.joinpath("index.json").exists():
+            _extract_bundle(path, directory)
+
+    index = json.loads(directory.joinpath("index.json").read_text())
+    if index["extension_suffix"] not in importlib.machinery.EXTENSION_SUFFIXES:
+        logger.warning(f"Ignoring bundle {path}, built for extension modules '{index['extension_suffix']}'")
+        return 0
+
+    with _bundles_lock:
+        if all(directory != d for d, _ in _bundles):
+            _bundles.append((directory, frozenset(index["modules"])))
+    return len(index["modules"])
+
+
+def clear_bundles():
+    """Stop using all loaded bundles."""
+    with _bundles_lock:
+        _bundles.clear()
+
+
+def _extract_bundle(path, directory):
+    """Extract a bundle archive, moving it into place once complete."""
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=".ffcx-bundle-", dir=directory.parent))
     try:
-        # Create C file with exclusive access
-        open(c_filename, "x")
-        return None, None
-    except FileExistsError:
-        logger.info("Cached C file already exists: " + str(c_filename))
-        finder = importlib.machinery.FileFinder(
-            str(cache_dir), (importlib.machinery.ExtensionFileLoader, importlib.machinery.EXTENSION_SUFFIXES))
-        finder.invalidate_caches()
-
-        # Now, wait for ready
-        for i in range(timeout):
-            if os.path.exists(ready_name):
-                spec = finder.find_spec(module_name)
-                if spec is None:
-                    raise ModuleNotFoundError("Unable to find JIT module.")
-                compiled_module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(compiled_module)
-
-                compiled_objects = [getattr(compiled_module.lib, "create_" + name)() for name in object_names]
-                return compiled_objects, compiled_module
-
-            logger.info(f"Waiting for {ready_name} to appear.")
-            time.sleep(1)
-        raise TimeoutError(f"""JIT compilation timed out, probably due to a failed previous compile.
-        Try cleaning cache (e.g. remove {c_filename}) or increase timeout parameter.""")
+        with tarfile.open(path) as tar:
+            for member in tar:
+                if not member.isfile() or Path(member.name).name != member.name:
+                    raise ValueError(f"Invalid member {member.name} in bundle {path}")
+                with tar.extractfile(member) as src, open(tmp_dir.joinpath(member.name), "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+        try:
+            os.rename(tmp_dir, directory)
+        except OSError:
+            # Extracted by another process in the meantime
+            if not directory.joinpath("index.json").exists():
+                raise
+    finally:
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+
+
+def _bundle_lookup(module_name):
+    """Return the directory of a loaded bundle containing module_name, or None."""
+    with _bundles_lock:
+        for directory, module_names in _bundles:
+            if module_name in module_names:
+                return directory
+    return None
 
 
 def compile_elements(elements, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                     cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
+                     cffi_verbose=False, cffi_debug=None, cffi_libraries=None, jobs=1, lazy=False,
+                     local_cache_dir=None, ir_jobs=1):
     """Compile a list of UFL elements and dofmaps into Python objects."""
     p = ffcx.parameters.get_parameters(parameters)
 
@@ -105,42 +692,40 @@ def compile_elements(elements, parameters=None, cache_dir=None, timeout=10, cffi
         name = ffcx.naming.dofmap_name(e, "JIT")
         names.append(name)
 
-    if cache_dir is not None:
-        cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, names, cache_dir, timeout)
-        if obj is not None:
-            # Pair up elements with dofmaps
-            obj = list(zip(obj[::2], obj[1::2]))
-            return obj, mod
-    else:
-        cache_dir = Path(tempfile.mkdtemp())
+    scalar_type = p["scalar_type"].replace("complex", "_Complex")
+    decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL
+    element_template = "ufc_finite_element * create_{name}(void);\n"
+    dofmap_template = "ufc_dofmap * create_{name}(void);\n"
+    for i in range(len(elements)):
+        decl += element_template.format(name=names[i * 2])
+        decl += dofmap_template.format(name=names[i * 2 + 1])
+
+    objects, module = _compile_module(decl, elements, names, module_name, p, cache_dir, timeout,
+                                      cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, jobs, lazy,
+                                      local_cache_dir, ir_jobs)
 
-    try:
-        scalar_type = p["scalar_type"].replace("complex", "_Complex")
-        decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL
-        element_template = "ufc_finite_element * create_{name}(void);\n"
-        dofmap_template = "ufc_dofmap * create_{name}(void);\n"
-        for i in range(len(elements)):
-            decl += element_template.format(name=names[i * 2])
-            decl += dofmap_template.format(name=names[i * 2 + 1])
-
-        _compile_objects(decl, elements, names, module_name, p, cache_dir,
-                         cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
-    except Exception:
-        # remove c file so that it will not timeout next time
-        c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
-        raise
-
-    objects, module = _load_objects(cache_dir, module_name, names)
     # Pair up elements with dofmaps
-    objects = list(zip(objects[::2], objects[1::2]))
+    if lazy:
+        objects = _LazyObjects(module, zip(names[::2], names[1::2]))
+    else:
+        objects = list(zip(objects[::2], objects[1::2]))
     return objects, module
 
 
 def compile_forms(forms, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                  cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
-    """Compile a list of UFL forms into UFC Python objects."""
+                  cffi_verbose=False, cffi_debug=None, cffi_libraries=None, jobs=1, lazy=False,
+                  local_cache_dir=None, ir_jobs=1):
+    """Compile a list of UFL forms into UFC Python objects.
+
+    The integral kernels are compiled by jobs C compiler processes at
+    once. With ir_jobs > 1, the IR of the integrals is computed and
+    their code generated in a pool of ir_jobs worker processes, which
+    are spawned rather than forked. This only pays off for forms with
+    many expensive integrals, as each worker imports FFCX and tabulates
+    its elements afresh. The calling script must then guard its main
+    code with if __name__ == "__main__", and the forms must be
+    picklable.
+    """
     p = ffcx.parameters.get_parameters(parameters)
 
     # Get a signature for these forms
@@ -150,37 +735,22 @@ def compile_forms(forms, parameters=None, cache_dir=None, timeout=10, cffi_extra
 
     form_names = [ffcx.naming.form_name(form, i) for i, form in enumerate(forms)]
 
-    if cache_dir is not None:
-        cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, form_names, cache_dir, timeout)
-        if obj is not None:
-            return obj, mod
-    else:
-        cache_dir = Path(tempfile.mkdtemp())
-
-    try:
-        scalar_type = p["scalar_type"].replace("complex", "_Complex")
-        decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
-            UFC_COORDINATEMAPPING_DECL + UFC_INTEGRAL_DECL + UFC_FORM_DECL
-
-        form_template = "ufc_form * create_{name}(void);\n"
-        for name in form_names:
-            decl += form_template.format(name=name)
+    scalar_type = p["scalar_type"].replace("complex", "_Complex")
+    decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
+        UFC_COORDINATEMAPPING_DECL + UFC_INTEGRAL_DECL + UFC_FORM_DECL
 
-        _compile_objects(decl, forms, form_names, module_name, p, cache_dir,
-                         cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
-    except Exception:
-        # remove c file so that it will not timeout next time
-        c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
-        raise
+    form_template = "ufc_form * create_{name}(void);\n"
+    for name in form_names:
+        decl += form_template.format(name=name)
 
-    obj, module = _load_objects(cache_dir, module_name, form_names)
-    return obj, module
+    return _compile_module(decl, forms, form_names, module_name, p, cache_dir, timeout,
+                           cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, jobs, lazy,
+                           local_cache_dir, ir_jobs)
 
 
 def compile_expressions(expressions, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                        cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
+                        cffi_verbose=False, cffi_debug=None, cffi_libraries=None, jobs=1, lazy=False,
+                        local_cache_dir=None, ir_jobs=1):
     """Compile a list of UFL expressions into UFC Python objects.
 
     Parameters
@@ -191,43 +761,30 @@ def compile_expressions(expressions, parameters=None, cache_dir=None, timeout=10
     """
     p = ffcx.parameters.get_parameters(parameters)
 
-    # Get a signature for these forms
-    module_name = 'libffcx_expressions_' + ffcx.naming.compute_signature(expressions, '', p)
+    # Get a signature for these expressions
+    module_name = 'libffcx_expressions_' + \
+        ffcx.naming.compute_signature(expressions, _compute_parameter_signature(p)
+                                      + str(cffi_extra_compile_args) + str(cffi_debug))
 
     expr_names = ["expression_{!s}".format(ffcx.naming.compute_signature([expression], "", p))
                   for expression in expressions]
 
-    if cache_dir is not None:
-        cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, expr_names, cache_dir, timeout)
-        if obj is not None:
-            return obj, mod
-    else:
-        cache_dir = Path(tempfile.mkdtemp())
-
-    try:
-        scalar_type = p["scalar_type"].replace("complex", "_Complex")
-        decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
-            UFC_COORDINATEMAPPING_DECL + UFC_INTEGRAL_DECL + UFC_FORM_DECL + UFC_EXPRESSION_DECL
+    scalar_type = p["scalar_type"].replace("complex", "_Complex")
+    decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
+        UFC_COORDINATEMAPPING_DECL + UFC_INTEGRAL_DECL + UFC_FORM_DECL + UFC_EXPRESSION_DECL
 
-        expression_template = "ufc_expression* create_{name}(void);\n"
-        for name in expr_names:
-            decl += expression_template.format(name=name)
+    expression_template = "ufc_expression* create_{name}(void);\n"
+    for name in expr_names:
+        decl += expression_template.format(name=name)
 
-        _compile_objects(decl, expressions, expr_names, module_name, p, cache_dir,
-                         cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
-    except Exception:
-        # remove c file so that it will not timeout next time
-        c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
-        raise
-
-    obj, module = _load_objects(cache_dir, module_name, expr_names)
-    return obj, module
+    return _compile_module(decl, expressions, expr_names, module_name, p, cache_dir, timeout,
+                           cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, jobs, lazy,
+                           local_cache_dir, ir_jobs)
 
 
 def compile_coordinate_maps(meshes, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                            cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
+                            cffi_verbose=False, cffi_debug=None, cffi_libraries=None, jobs=1, lazy=False,
+                            local_cache_dir=None, ir_jobs=1):
     """Compile a list of UFL coordinate mappings into UFC Python objects."""
     p = ffcx.parameters.get_parameters(parameters)
 
@@ -239,45 +796,143 @@ def compile_coordinate_maps(meshes, parameters=None, cache_dir=None, timeout=10,
     cmap_names = [ffcx.naming.coordinate_map_name(
         mesh.ufl_coordinate_element(), "JIT") for mesh in meshes]
 
-    if cache_dir is not None:
-        cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, cmap_names, cache_dir, timeout)
-        if obj is not None:
-            return obj, mod
-    else:
-        cache_dir = Path(tempfile.mkdtemp())
+    scalar_type = p["scalar_type"].replace("complex", "_Complex")
+    decl = UFC_HEADER_DECL.format(scalar_type) + UFC_COORDINATEMAPPING_DECL + UFC_DOFMAP_DECL
+    cmap_template = "ufc_coordinate_mapping * create_{name}(void);\n"
+
+    for name in cmap_names:
+        decl += cmap_template.format(name=name)
+
+    return _compile_module(decl, meshes, cmap_names, module_name, p, cache_dir, timeout,
+                           cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, jobs, lazy,
+                           local_cache_dir, ir_jobs)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="ffcx-jit")
+        return _executor
+
+
+def compile_elements_async(elements, executor=None, **kwargs):
+    """Start compiling a list of UFL elements and dofmaps in the background.
+
+    Returns a concurrent.futures.Future for the result of
+    compile_elements, see compile_forms_async.
+    """
+    return (executor or _get_executor()).submit(compile_elements, elements, **kwargs)
 
-    try:
-        scalar_type = p["scalar_type"].replace("complex", "_Complex")
-        decl = UFC_HEADER_DECL.format(scalar_type) + UFC_COORDINATEMAPPING_DECL + UFC_DOFMAP_DECL
-        cmap_template = "ufc_coordinate_mapping * create_{name}(void);\n"
 
-        for name in cmap_names:
-            decl += cmap_template.format(name=name)
+def compile_forms_async(forms, executor=None, **kwargs):
+    """Start compiling a list of UFL forms in the background.
 
-        _compile_objects(decl, meshes, cmap_names, module_name, p, cache_dir,
-                         cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
-    except Exception:
-        # remove c file so that it will not timeout next time
-        c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
-        raise
+    Analysis, code generation and C compilation run in a worker thread,
+    so they overlap with work in the calling thread (the C compiler
+    runs as a separate process). Keyword arguments are passed to
+    compile_forms.
 
-    obj, module = _load_objects(cache_dir, module_name, cmap_names)
-    return obj, module
+    Returns a concurrent.futures.Future for the result of compile_forms.
+    Use asyncio.wrap_future to await it from a coroutine.
+
+    Parameters
+    ----------
+    executor
+        concurrent.futures.Executor to compile in. Defaults to a shared
+        single-thread executor, so compilations run one at a time.
+
+    """
+    return (executor or _get_executor()).submit(compile_forms, forms, **kwargs)
+
+
+def compile_expressions_async(expressions, executor=None, **kwargs):
+    """Start compiling a list of UFL expressions in the background.
+
+    Returns a concurrent.futures.Future for the result of
+    compile_expressions, see compile_forms_async.
+    """
+    return (executor or _get_executor()).submit(compile_expressions, expressions, **kwargs)
+
+
+def compile_coordinate_maps_async(meshes, executor=None, **kwargs):
+    """Start compiling a list of UFL coordinate mappings in the background.
+
+    Returns a concurrent.futures.Future for the result of
+    compile_coordinate_maps, see compile_forms_async.
+    """
+    return (executor or _get_executor()).submit(compile_coordinate_maps, meshes, **kwargs)
+
+
+def _compile_module(decl, ufl_objects, object_names, module_name, parameters, cache_dir, timeout,
+                    cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, jobs, lazy, local_cache_dir,
+                    ir_jobs):
+    """Return UFC objects and module from the in-process registry, a bundle, the cache or by compiling.
+
+    Unless lazy is True, all UFC objects are created before returning.
+    """
+    key = _registry_key(module_name, cache_dir)
+    entry = _registry_get(key)
+    if entry is not None:
+        obj, module = entry
+        return (obj if lazy else list(obj)), module
+
+    bundle_dir = _bundle_lookup(module_name)
+    if bundle_dir is not None:
+        logger.info(f"Loading JIT module {module_name} from bundle {bundle_dir}")
+        obj, module = _load_objects(bundle_dir, module_name, object_names)
+        _registry_put(key, obj, module)
+        return (obj if lazy else list(obj)), module
+
+    # The IR is only worth caching in a persistent cache directory
+    persistent = cache_dir is not None
+    if cache_dir is None:
+        cache_dir = tempfile.mkdtemp()
+    cache_dir = Path(cache_dir)
+
+    # With a local cache tier, compile there and publish to cache_dir
+    build_dir = cache_dir if local_cache_dir is None else Path(local_cache_dir)
+    ir_cache_dir = build_dir.joinpath("ir") if persistent else None
+
+    with _lock_cached_module(module_name, object_names, cache_dir, timeout, local_cache_dir) as (obj, module):
+        if obj is None:
+            try:
+                _compile_objects(decl, ufl_objects, object_names, module_name, parameters, build_dir,
+                                 cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, jobs,
+                                 ir_cache_dir, ir_jobs)
+            except Exception:
+                # Mark the compilation as failed, so that waiting
+                # processes give up and the next attempt starts afresh
+                c_filename = build_dir.joinpath(module_name + ".c")
+                failed_name = cache_dir.joinpath(module_name + ".c.failed")
+                if c_filename.exists() and build_dir == cache_dir:
+                    os.replace(c_filename, failed_name)
+                elif c_filename.exists():
+                    shutil.copyfile(c_filename, failed_name)
+                    c_filename.unlink()
+                else:
+                    failed_name.touch()
+                raise
+            _record_cache_stats(build_dir, module_misses=1)
+            _copy_module(build_dir, cache_dir, module_name)
+            obj, module = _load_objects(build_dir, module_name, object_names)
+
+    _registry_put(key, obj, module)
+    return (obj if lazy else list(obj)), module
 
 
 def _compile_objects(decl, ufl_objects, object_names, module_name, parameters, cache_dir,
-                     cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries):
+                     cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, jobs, ir_cache_dir=None,
+                     ir_jobs=1):
 
     import ffcx.compiler
 
-    _, code_body = ffcx.compiler.compile_ufl_objects(ufl_objects, prefix="JIT", parameters=parameters)
-
-    ffibuilder = cffi.FFI()
-    ffibuilder.set_source(module_name, code_body, include_dirs=[ffcx.codegeneration.get_include_path()],
-                          extra_compile_args=cffi_extra_compile_args, libraries=cffi_libraries)
-    ffibuilder.cdef(decl)
+    # Generate each integral kernel as a separate translation unit, so
+    # that kernels can be compiled concurrently and shared through the
+    # object cache
+    _, (code_body, *kernels) = ffcx.compiler.compile_ufl_objects(ufl_objects, prefix="JIT",
+                                                                 parameters=parameters, split_kernels=True,
+                                                                 ir_cache_dir=ir_cache_dir, jobs=ir_jobs)
 
     c_filename = cache_dir.joinpath(module_name + ".c")
     ready_name = c_filename.with_suffix(".c.cached")
@@ -291,7 +946,18 @@ def _compile_objects(decl, ufl_objects, object_names, module_name, parameters, c
 
     t0 = time.time()
     f = io.StringIO()
-    with redirect_stdout(f):
+    with _capture_stdout(f):
+        kernel_objects, kernel_symbols = _compile_kernels(kernels, cache_dir, jobs,
+                                                          cffi_extra_compile_args, cffi_debug)
+
+        # Refer to the kernels by their content-addressed symbols
+        code_body = "".join(f"#define {name} {symbol}\n" for name, symbol in kernel_symbols.items()) + code_body
+
+        ffibuilder = cffi.FFI()
+        ffibuilder.set_source(module_name, code_body, include_dirs=[ffcx.codegeneration.get_include_path()],
+                              extra_compile_args=cffi_extra_compile_args, libraries=cffi_libraries,
+                              extra_objects=kernel_objects)
+        ffibuilder.cdef(decl)
         ffibuilder.compile(tmpdir=cache_dir, verbose=True, debug=cffi_debug)
     s = f.getvalue()
     if (cffi_verbose):
@@ -306,6 +972,103 @@ def _compile_objects(decl, ufl_objects, object_names, module_name, parameters, c
     fd.write(s)
     fd.close()
 
+    # Remove intermediate files, which are only useful for debugging
+    if not cffi_debug:
+        for intermediate in (c_filename, c_filename.with_suffix(".o")):
+            if intermediate.exists():
+                intermediate.unlink()
+
+
+def _compile_kernels(kernels, cache_dir, jobs, cffi_extra_compile_args, cffi_debug):
+    """Compile kernel translation units to object files, reusing the content-addressed object cache.
+
+    Each kernel is renamed after the hash of its source and of the
+    compiler flags, so identical kernels generated from different forms
+    share one object file in ``cache_dir/objects``. Missing objects are
+    compiled using a pool of ``jobs`` workers.
+
+    Returns the list of object file names, for linking into the module,
+    and a dict mapping the generated kernel names to their symbols.
+
+    """
+    # distutils is removed from Python 3.12, and setuptools, which cffi
+    # also needs to compile there, ships its own copy
+    try:
+        from setuptools._distutils.ccompiler import new_compiler
+        from setuptools._distutils.sysconfig import customize_compiler
+    except ImportError:
+        from distutils.ccompiler import new_compiler
+        from distutils.sysconfig import customize_compiler
+
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    flags = str(compiler.compiler_so) + str(cffi_extra_compile_args) + str(bool(cffi_debug))
+
+    # cffi links the module from its own build directory, so the
+    # objects are referred to by absolute paths
+    object_dir = cache_dir.joinpath("objects").absolute()
+    object_dir.mkdir(exist_ok=True, parents=True)
+
+    objects = {}
+    symbols = {}
+    for kernel in kernels:
+        # The kernel, followed by the batched kernel if there is one
+        names = _kernel_name.findall(kernel)
+        source = kernel
+        for name in names:
+            source = source.replace(name, "")
+        signature = hashlib.sha1((source + flags).encode("utf-8")).hexdigest()
+        source = kernel
+        for i, name in enumerate(names):
+            symbols[name] = "tabulate_tensor_" + signature + ("_batch" if i else "")
+            source = source.replace(name, symbols[name])
+        object_name = object_dir.joinpath(signature + compiler.obj_extension)
+        if object_name not in objects:
+            objects[object_name] = source
+
+    missing = []
+    for object_name, source in objects.items():
+        if object_name.exists():
+            _touch(object_name)
+        else:
+            missing.append((object_name, source))
+    logger.info(f"Object cache: {len(objects) - len(missing)} of {len(objects)} kernels found in {object_dir}")
+    _record_cache_stats(cache_dir, object_hits=len(objects) - len(missing), object_misses=len(missing))
+
+    def compile_one(item):
+        object_name, source = item
+        compiler = new_compiler()
+        customize_compiler(compiler)
+
+        # Build from uniquely named files and move the result into
+        # place, so that processes compiling the same kernel do not
+        # clash
+        fd, tmp_source = tempfile.mkstemp(prefix="tmp", suffix=".c", dir=object_dir)
+        with os.fdopen(fd, "w") as f:
+            f.write(source)
+        try:
+            # An absolute source path with output_dir at the root places
+            # the object file next to the source
+            with _capture_stdout(io.StringIO()) as out:
+                tmp_object, = compiler.compile([tmp_source], output_dir=Path(tmp_source).anchor,
+                                               include_dirs=[ffcx.codegeneration.get_include_path()],
+                                               debug=bool(cffi_debug), extra_postargs=cffi_extra_compile_args)
+            os.replace(tmp_object, object_name)
+            if cffi_debug:
+                os.replace(tmp_source, object_name.with_suffix(".c"))
+        finally:
+            if os.path.exists(tmp_source):
+                os.remove(tmp_source)
+        return out.getvalue()
+
+    # The compiler runs as a subprocess, so threads are enough to keep
+    # several compilations going at once
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for output in executor.map(compile_one, missing):
+            sys.stdout.write(output)
+
+    return [str(object_name) for object_name in objects], symbols
+
 
 def _load_objects(cache_dir, module_name, object_names):
 
@@ -324,12 +1087,42 @@ def _load_objects(cache_dir, module_name, object_names):
     compiled_module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(compiled_module)
 
-    compiled_objects = []
-    for name in object_names:
+    return _LazyObjects(compiled_module, object_names), compiled_module
+
+
+class _LazyObjects(collections.abc.Sequence):
+    """Sequence of UFC objects from a JIT module, created on first access.
+
+    Each object is created once per module and shared by all sequences
+    over that module. A name may be a tuple of names, giving a tuple of
+    objects.
+    """
+
+    def __init__(self, module, names):
+        self.module = module
+        self.names = list(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return _LazyObjects(self.module, self.names[i])
+        name = self.names[i]
+        if isinstance(name, tuple):
+            return tuple(_create_object(self.module, n) for n in name)
+        return _create_object(self.module, name)
+
+
+def _create_object(module, name):
+    """Return the UFC object created by the factory for name in module, creating it on first use."""
+    created = module.__dict__.setdefault("_ffcx_objects", {})
+    obj = created.get(name)
+    if obj is None:
         # Call UFC factory to create object data struct (calls malloc)
-        obj = getattr(compiled_module.lib, "create_" + name)()
+        obj = getattr(module.lib, "create_" + name)()
 
         # Set garbage collector to use C free()
-        compiled_objects.append(compiled_module.ffi.gc(obj, compiled_module.lib.free))
-
-    return compiled_objects, compiled_module
+        obj = module.ffi.gc(obj, module.lib.free)
+        created[name] = obj
+    return obj
@@ -83,12 +83,11 @@ class FFCXBackendSymbols(object):
             # Always 0 for cells (even with restriction)
             return self.L.LiteralInt(0)
         elif entitytype == "facet":
-            postfix = "[0]"
             if restriction == "-":
-                postfix = "[1]"
-            return self.S("facet" + postfix)
+                return self.S("facet")[1]
+            return self.S("facet")[0]
         elif entitytype == "vertex":
-            return self.S("vertex[0]")
+            return self.S("vertex")[0]
         else:
             logging.exception(f"Unknown entitytype {entitytype}")
 
@@ -97,6 +96,11 @@ class FFCXBackendSymbols(object):
         indices = ["i", "j", "k", "l"]
         return self.S(indices[iarg])
 
+    def argument_grid_index(self, iarg, direction):
+        """Loop index for the 1D functions of argument #iarg in a direction of a tensor product grid."""
+        indices = ["i", "j", "k", "l"]
+        return self.S(f"{indices[iarg]}{direction}")
+
     def entity_permutation(self, L, i, cell_shape):
         """Returns the int that gives the permutation of the entity."""
         cell_info = self.S("cell_permutation")
@@ -154,6 +158,10 @@ class FFCXBackendSymbols(object):
         """Reusing a single index name for all quadrature loops, assumed not to be nested."""
         return self.S("iq")
 
+    def quadrature_grid_index(self, direction):
+        """Loop index for the 1D quadrature points in a direction of a tensor product grid."""
+        return self.S(f"iq{direction}")
+
     def quadrature_permutation(self, index):
         """Quadrature permutation, as input to the function."""
         return self.S("quadrature_permutation")[index]
@@ -307,6 +307,24 @@ extern "C"
       const uint8_t* restrict quadrature_permutation,
       uint32_t cell_permutation);
 
+  /// Tabulate the tensors of a batch of cells
+  ///
+  /// The arguments are those of ufc_tabulate_tensor for each of the
+  /// num_cells cells, in a structure-of-arrays layout: entry i of an
+  /// argument for cell k is stored at [i * num_cells + k]. The
+  /// constants c are shared by all cells, and cell_permutation holds
+  /// one value per cell.
+  ///
+  /// @see ufc_tabulate_tensor
+  ///
+  typedef void(ufc_tabulate_tensor_batch)(
+      int num_cells, ufc_scalar_t* restrict A,
+      const ufc_scalar_t* restrict w, const ufc_scalar_t* restrict c,
+      const double* restrict coordinate_dofs,
+      const int* restrict entity_local_index,
+      const uint8_t* restrict quadrature_permutation,
+      const uint32_t* restrict cell_permutation);
+
   /// Tabulate integral into tensor A with runtime quadrature rule
   ///
   /// @see ufc_tabulate_tensor
@@ -323,6 +341,10 @@ extern "C"
     const bool* enabled_coefficients;
     ufc_tabulate_tensor* tabulate_tensor;
     bool needs_permutation_data;
+
+    /// Batched variant of tabulate_tensor, or NULL if the integral
+    /// has none
+    ufc_tabulate_tensor_batch* tabulate_tensor_batch;
   } ufc_integral;
 
   typedef struct ufc_custom_integral
@@ -63,58 +63,156 @@ Compiler stages:
 
 """
 
+import json
 import logging
 import os
+import pickle
+import tempfile
 import typing
+from pathlib import Path
 from time import time
 
+import basix
+import ufl
+from ffcx import naming
 from ffcx.analysis import analyze_ufl_objects
 from ffcx.codegeneration.codegeneration import generate_code
-from ffcx.formatting import format_code
+from ffcx.formatting import format_code, format_code_units
 from ffcx.ir.representation import compute_ir
+from ffcx.parameters import FFCX_DEFAULT_PARAMETERS
 
 logger = logging.getLogger("ffcx")
 
+# Parameters which only affect code generation (or nothing at all) and
+# are left out of the IR cache key
+codegen_parameters = ("assume_aligned", "batch_kernels", "padlen", "simd_width", "tabulate_tensor_void",
+                      "verbosity")
+
 
 def _print_timing(stage, timing):
     logger.info("Compiler stage {stage} finished in {time:.4f} seconds.".format(
         stage=stage, time=timing))
 
 
+def _ir_cache_key(ufl_objects, object_names, prefix, parameters):
+    """Return the IR cache key of the objects.
+
+    The key covers the object signatures, the parameters used by the
+    analysis and IR stages, the basix version, which determines the
+    tabulated tables, and the names the IR takes from the objects
+    themselves, which the renumbered UFL signatures do not."""
+    names = []
+    for obj in ufl_objects:
+        if isinstance(obj, ufl.Form):
+            functions = list(obj.arguments()) + list(obj.coefficients()) + list(obj.constants())
+            names.append([object_names.get(id(obj))] + [object_names.get(id(f), str(f)) for f in functions])
+    ir_parameters = {name: value for name, value in parameters.items()
+                     if name in FFCX_DEFAULT_PARAMETERS and name not in codegen_parameters}
+    tag = json.dumps([prefix, names, ir_parameters, basix.__version__], sort_keys=True, default=str)
+    try:
+        return naming.compute_signature(ufl_objects, tag)
+    except RuntimeError:
+        # Objects without a signature are not cached
+        return None
+
+
+def _load_ir(ir_cache_dir, key, parameters):
+    """Return the cached IR for key, or None."""
+    path = Path(ir_cache_dir).joinpath(key + ".pickle")
+    try:
+        with open(path, "rb") as f:
+            ir = pickle.load(f)
+        # Mark as recently used for cache pruning
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable IR cache entry {key}: {e}")
+        return None
+
+    # Kernel IR carries the parameters for code generation, which are
+    # not part of the key
+    return ir._replace(integrals=[itg._replace(params=parameters) for itg in ir.integrals],
+                       expressions=[expr._replace(params=parameters) for expr in ir.expressions])
+
+
+def _store_ir(ir_cache_dir, key, ir):
+    """Store the IR for key, atomically."""
+    ir_cache_dir = Path(ir_cache_dir)
+    ir_cache_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix="tmp", dir=ir_cache_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(ir, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_name, ir_cache_dir.joinpath(key + ".pickle"))
+    except Exception as e:
+        os.unlink(tmp_name)
+        logger.warning(f"Could not store IR cache entry {key}: {e}")
+
+
 def compile_ufl_objects(ufl_objects: typing.Union[typing.List, typing.Tuple],
                         object_names: typing.Dict = {},
                         prefix: str = None,
                         parameters: typing.Dict = None,
-                        visualise: bool = False):
+                        visualise: bool = False,
+                        split_kernels: bool = False,
+                        ir_cache_dir: typing.Optional[str] = None,
+                        jobs: int = 1):
     """Generate UFC code for a given UFL objects.
 
     Parameters
     ----------
     @param ufl_objects:
         Objects to be compiled. Accepts elements, forms, integrals or coordinate mappings.
+    @param split_kernels:
+        If True, return the source as a list of translation units, one
+        for the factories and one for each integral kernel, which can
+        be compiled independently.
+    @param ir_cache_dir:
+        If given, the intermediate representation is cached in this
+        directory, and stages 1 and 2 are skipped when the objects were
+        compiled before with the same analysis and IR parameters.
+    @param jobs:
+        Number of processes computing the IR of and generating code for
+        the integrals in parallel. The processes are spawned, so with
+        jobs > 1 the calling script must guard its main code with
+        if __name__ == "__main__".
 
     """
     if prefix != os.path.basename(prefix):
         raise RuntimeError("Invalid prefix, looks like a full path? prefix='{}'.".format(prefix))
 
-    # Stage 1: analysis
-    cpu_time = time()
-    analysis = analyze_ufl_objects(ufl_objects, parameters)
-    _print_timing(1, time() - cpu_time)
-
-    # Stage 2: intermediate representation
-    cpu_time = time()
-    ir = compute_ir(analysis, object_names, prefix, parameters, visualise)
-    _print_timing(2, time() - cpu_time)
+    key = None
+    if ir_cache_dir is not None and not visualise:
+        key = _ir_cache_key(ufl_objects, object_names, prefix, parameters)
+    ir = None if key is None else _load_ir(ir_cache_dir, key, parameters)
+    if ir is not None:
+        logger.info("Compiler stages 1 and 2 skipped, using cached IR {}.".format(key))
+    else:
+        # Stage 1: analysis
+        cpu_time = time()
+        analysis = analyze_ufl_objects(ufl_objects, parameters)
+        _print_timing(1, time() - cpu_time)
+
+        # Stage 2: intermediate representation
+        cpu_time = time()
+        ir = compute_ir(analysis, object_names, prefix, parameters, visualise, jobs=jobs)
+        _print_timing(2, time() - cpu_time)
+
+        if key is not None:
+            _store_ir(ir_cache_dir, key, ir)
 
     # Stage 3: code generation
     cpu_time = time()
-    code = generate_code(ir, parameters)
+    code = generate_code(ir, parameters, jobs=jobs)
     _print_timing(3, time() - cpu_time)
 
     # Stage 4: format code
     cpu_time = time()
-    code_h, code_c = format_code(code, parameters)
+    if split_kernels:
+        code_h, code_c = format_code_units(code, parameters)
+    else:
+        code_h, code_c = format_code(code, parameters)
     _print_timing(4, time() - cpu_time)
 
     return code_h, code_c
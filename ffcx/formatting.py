@@ -66,6 +66,59 @@ def format_code(code: namedtuple, parameters):
     logger.info("Compiler stage 5: Formatting code")
     logger.info(79 * "*")
 
+    code_h_pre, code_h_post, code_c_pre = _generate_preamble(parameters)
+
+    code_h = ""
+    code_c = ""
+
+    for parts_code in code:
+        code_h += "".join([c[0] for c in parts_code])
+        code_c += "".join(["".join(c[1:]) for c in parts_code])
+
+    # Add headers to body
+    code_h = code_h_pre + code_h + code_h_post
+    code_c = code_c_pre + code_c
+
+    return code_h, code_c
+
+
+def format_code_units(code: namedtuple, parameters):
+    """Format given code in UFC format, splitting the source into separate translation units.
+
+    Returns the header file contents and a list of source file contents.
+    The first source contains everything except the integral kernels,
+    each further source contains a single tabulate_tensor kernel.
+
+    """
+
+    logger.info(79 * "*")
+    logger.info("Compiler stage 5: Formatting code")
+    logger.info(79 * "*")
+
+    code_h_pre, code_h_post, code_c_pre = _generate_preamble(parameters)
+
+    code_h = ""
+    code_c = ""
+    kernels = []
+
+    for field, parts_code in zip(code._fields, code):
+        code_h += "".join([c[0] for c in parts_code])
+        if field == "integrals":
+            kernels += [c[1] for c in parts_code]
+            code_c += "".join([c[2] for c in parts_code])
+        else:
+            code_c += "".join([c[1] for c in parts_code])
+
+    # Add headers to body
+    code_h = code_h_pre + code_h + code_h_post
+    code_c = [code_c_pre + code_c] + [code_c_pre + kernel for kernel in kernels]
+
+    return code_h, code_c
+
+
+def _generate_preamble(parameters):
+    """Generate code preceding the header and source file bodies."""
+
     # Generate code for comment at top of file
     code_h_pre = _generate_comment(parameters) + "\n"
     code_c_pre = _generate_comment(parameters) + "\n"
@@ -88,18 +141,7 @@ def format_code(code: namedtuple, parameters):
     code_h_pre += c_extern_pre
     code_h_post = c_extern_post
 
-    code_h = ""
-    code_c = ""
-
-    for parts_code in code:
-        code_h += "".join([c[0] for c in parts_code])
-        code_c += "".join([c[1] for c in parts_code])
-
-    # Add headers to body
-    code_h = code_h_pre + code_h + code_h_post
-    code_c = code_c_pre + code_c
-
-    return code_h, code_c
+    return code_h_pre, code_h_post, code_c_pre
 
 
 def write_code(code_h, code_c, prefix, output_dir):
@@ -22,8 +22,8 @@ def build_argument_indices(S):
     """Build ordered list of indices to modified arguments."""
 
     arg_indices = []
-    for i, v in S.nodes.items():
-        arg = strip_modified_terminal(v['expression'])
+    for i, expr in enumerate(S.expressions):
+        arg = strip_modified_terminal(expr)
         if isinstance(arg, Argument):
             arg_indices.append(i)
 
@@ -31,7 +31,7 @@ def build_argument_indices(S):
     def arg_ordering_key(i):
         """Return a key for sorting argument vertex indices.
         Key is based on the properties of the modified terminal."""
-        mt = analyse_modified_terminal(S.nodes[i]['expression'])
+        mt = analyse_modified_terminal(S.expressions[i])
         return mt.argument_ordering_key()
 
     ordered_arg_indices = sorted(arg_indices, key=arg_ordering_key)
@@ -87,8 +87,8 @@ def handle_sum(v, fac, sf, F):
             elif fi1 is None:
                 fisum = fi0
             else:
-                f0 = F.nodes[fi0]['expression']
-                f1 = F.nodes[fi1]['expression']
+                f0 = F.expressions[fi0]
+                f1 = F.expressions[fi1]
                 fisum = graph_insert(F, f0 + f1)
             factors[argkey] = fisum
 
@@ -113,7 +113,7 @@ def handle_product(v, fac, sf, F):
         f0 = sf[0]
         factors = {}
         for k1 in sorted(fac1):
-            f1 = F.nodes[fac1[k1]]['expression']
+            f1 = F.expressions[fac1[k1]]
             factors[k1] = graph_insert(F, f0 * f1)
 
     elif not fac1:  # arg * non-arg
@@ -121,16 +121,16 @@ def handle_product(v, fac, sf, F):
         f1 = sf[1]
         factors = {}
         for k0 in sorted(fac0):
-            f0 = F.nodes[fac0[k0]]['expression']
+            f0 = F.expressions[fac0[k0]]
             factors[k0] = graph_insert(F, f1 * f0)
 
     else:  # arg * arg
         # Record products of each factor of arg-dependent operand
         factors = {}
         for k0 in sorted(fac0):
-            f0 = F.nodes[fac0[k0]]['expression']
+            f0 = F.expressions[fac0[k0]]
             for k1 in sorted(fac1):
-                f1 = F.nodes[fac1[k1]]['expression']
+                f1 = F.expressions[fac1[k1]]
                 argkey = tuple(sorted(k0 + k1))  # sort key for canonical representation
                 factors[argkey] = graph_insert(F, f0 * f1)
 
@@ -144,7 +144,7 @@ def handle_conj(v, fac, sf, F):
     if fac:
         factors = {}
         for k in fac:
-            f0 = F.nodes[fac[k]]['expression']
+            f0 = F.expressions[fac[k]]
             factors[k] = graph_insert(F, Conj(f0))
     else:
         raise RuntimeError("No arguments")
@@ -163,7 +163,7 @@ def handle_division(v, fac, sf, F):
         f1 = sf[1]
         factors = {}
         for k0 in sorted(fac0):
-            f0 = F.nodes[fac0[k0]]['expression']
+            f0 = F.expressions[fac0[k0]]
             factors[k0] = graph_insert(F, f0 / f1)
 
     else:  # non-arg / non-arg
@@ -201,8 +201,8 @@ def handle_conditional(v, fac, sf, F):
         for k in mas:
             fi1 = fac1.get(k)
             fi2 = fac2.get(k)
-            f1 = z if fi1 is None else F.nodes[fi1]['expression']
-            f2 = z if fi2 is None else F.nodes[fi2]['expression']
+            f1 = z if fi1 is None else F.expressions[fi1]
+            f2 = z if fi2 is None else F.expressions[fi2]
             factors[k] = graph_insert(F, conditional(f0, f1, f2))
 
     return factors
@@ -241,7 +241,7 @@ def compute_argument_factorization(S, rank):
     """
     # Extract argument component subgraph
     arg_indices = build_argument_indices(S)
-    AV = [S.nodes[i]['expression'] for i in arg_indices]
+    AV = [S.expressions[i] for i in arg_indices]
 
     # Data structure for building non-argument factors
     F = ExpressionGraph()
@@ -266,17 +266,20 @@ def compute_argument_factorization(S, rank):
     # SV_factors[si] = { argkey1: fi1, argkey2: fi2, ... } # if SV[si]
     # is a linear combination of multiple argkey configurations
 
+    # Position of each argument vertex in arg_indices
+    arg_positions = {si: ai for ai, si in enumerate(arg_indices)}
+
     # Factorize each subexpression in order:
-    for si, attr in S.nodes.items():
+    SV_factors = []
+    for si, v in enumerate(S.expressions):
         deps = S.out_edges[si]
-        v = attr['expression']
 
-        if si in arg_indices:
+        if si in arg_positions:
             assert len(deps) == 0
             # v is a modified Argument
             factors = {(si, ): one_index}
         else:
-            fac = [S.nodes[d]['factors'] for d in deps]
+            fac = [SV_factors[d] for d in deps]
             if not any(fac):
                 # Entirely scalar (i.e. no arg factors)
                 # Just add unchanged to F
@@ -290,11 +293,12 @@ def compute_argument_factorization(S, rank):
                     if fac[i]:
                         sf.append(None)
                     else:
-                        sf.append(S.nodes[d]['expression'])
+                        sf.append(S.expressions[d])
                 # Use appropriate handler to deal with Sum, Product, etc.
                 factors = handler(v, fac, sf, F)
 
-        attr['factors'] = factors
+        S.nodes[si]['factors'] = factors
+        SV_factors.append(factors)
 
     assert len(F.nodes) == len(F.e2i)
 
@@ -317,7 +321,7 @@ def compute_argument_factorization(S, rank):
             # Map argkeys from indices into SV to indices into AV,
             # and resort keys for canonical representation
             for argkey, fi in S.nodes[S_target]['factors'].items():
-                ai_fi = {tuple(sorted(arg_indices.index(si) for si in argkey)): fi}
+                ai_fi = {tuple(sorted(arg_positions[si] for si in argkey)): fi}
                 for comp in S.nodes[S_target]["component"]:
                     if factors.get(comp):
                         factors[comp].update(ai_fi)
@@ -334,8 +338,7 @@ def compute_argument_factorization(S, rank):
             F.nodes[fi]["component"].append(comp)
 
     # Compute dependencies in FV
-    for i, v in F.nodes.items():
-        expr = v['expression']
+    for i, expr in enumerate(F.expressions):
         if not expr._ufl_is_terminal_ and not expr._ufl_is_terminal_modifier_:
             for o in expr.ufl_operands:
                 F.add_edge(i, F.e2i[o])
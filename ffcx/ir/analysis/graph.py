@@ -5,6 +5,8 @@
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 """Linearized data structure for the computational graph."""
 
+import array
+import collections.abc
 import logging
 
 import numpy
@@ -20,31 +22,206 @@ logger = logging.getLogger("ffcx")
 class ExpressionGraph(object):
     """A directed multi-edge graph.
     ExpressionGraph allows multiple edges between the same nodes,
-    and respects the insertion order of nodes and edges."""
+    and respects the insertion order of nodes and edges.
+
+    Nodes are numbered consecutively from zero. The node expressions
+    are stored in a list, the node status and target flags in NumPy
+    arrays and other node properties in one dict per property. Edges
+    are stored in compressed sparse row (CSR) arrays, which are rebuilt
+    when edges have been added. The nodes, out_edges and in_edges
+    attributes are dict-like views of this storage."""
+
+    statuses = ("inactive", "active", "piecewise", "varying")
 
     def __init__(self):
 
         # Data structures for directed multi-edge graph
-        self.nodes = {}
-        self.out_edges = {}
-        self.in_edges = {}
+        self.expressions = []
+        self._status = numpy.full(16, -1, dtype=numpy.int8)
+        self._target = numpy.zeros(16, dtype=bool)
+        self._properties = {}
+        self._sources = array.array("l")
+        self._destinations = array.array("l")
+        self._csr = None
+
+        self.nodes = NodesView(self)
+        self.out_edges = EdgesView(self, reverse=False)
+        self.in_edges = EdgesView(self, reverse=True)
 
     def number_of_nodes(self):
-        return len(self.nodes)
+        return len(self.expressions)
 
     def add_node(self, key, **kwargs):
         """Add a node with optional properties."""
-        self.nodes[key] = kwargs
-        self.out_edges[key] = []
-        self.in_edges[key] = []
+        if key != self.number_of_nodes():
+            raise KeyError("Nodes must be numbered consecutively")
+
+        if key == len(self._status):
+            self._status = numpy.concatenate((self._status, numpy.full(key, -1, dtype=numpy.int8)))
+            self._target = numpy.concatenate((self._target, numpy.zeros(key, dtype=bool)))
+        self.expressions.append(kwargs.pop("expression", None))
+        node = self.nodes[key]
+        for name, value in kwargs.items():
+            node[name] = value
 
     def add_edge(self, node1, node2):
         """Add a directed edge from node1 to node2."""
-        if node1 not in self.nodes or node2 not in self.nodes:
+        n = self.number_of_nodes()
+        if not (0 <= node1 < n and 0 <= node2 < n):
             raise KeyError("Adding edge to unknown node")
 
-        self.out_edges[node1] += [node2]
-        self.in_edges[node2] += [node1]
+        self._sources.append(node1)
+        self._destinations.append(node2)
+
+    @property
+    def status(self):
+        """Array of node status codes, indices into statuses or -1 if unset."""
+        return self._status[:self.number_of_nodes()]
+
+    def target_nodes(self):
+        """Return array of the nodes with a 'target' property."""
+        return numpy.flatnonzero(self._target[:self.number_of_nodes()])
+
+    def edges_csr(self, reverse=False):
+        """Return CSR arrays (offsets, indices) of the out edges, or of the in edges if reverse.
+
+        The edges of node i are indices[offsets[i]:offsets[i + 1]], in insertion order."""
+        n = self.number_of_nodes()
+        if self._csr is None or self._csr[0] != (n, len(self._sources)):
+            sources = numpy.array(self._sources, dtype=numpy.int32)
+            destinations = numpy.array(self._destinations, dtype=numpy.int32)
+            self._csr = ((n, len(self._sources)), _build_csr(n, sources, destinations),
+                         _build_csr(n, destinations, sources))
+        return self._csr[2] if reverse else self._csr[1]
+
+    def reachable(self, nodes, reverse=False, mask=None):
+        """Return boolean array marking the nodes reachable from the given nodes.
+
+        The given nodes are included. If mask is given, only nodes where
+        mask is True are visited."""
+        offsets, indices = self.edges_csr(reverse)
+        visited = numpy.zeros(self.number_of_nodes(), dtype=bool)
+        frontier = numpy.unique(numpy.asarray(nodes, dtype=numpy.int64))
+        while frontier.size:
+            if mask is not None:
+                frontier = frontier[mask[frontier]]
+            frontier = frontier[~visited[frontier]]
+            visited[frontier] = True
+
+            # Gather the edges of all frontier nodes
+            begin = offsets[frontier]
+            counts = offsets[frontier + 1] - begin
+            positions = numpy.arange(counts.sum()) + numpy.repeat(begin - (numpy.cumsum(counts) - counts), counts)
+            frontier = numpy.unique(indices[positions])
+        return visited
+
+
+def _build_csr(n, keys, values):
+    """Return CSR arrays (offsets, indices) of values grouped by keys, keeping their order within groups."""
+    offsets = numpy.zeros(n + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(keys, minlength=n), out=offsets[1:])
+    return offsets, values[numpy.argsort(keys, kind="stable")]
+
+
+class NodesView(collections.abc.Mapping):
+    """Dict-like view of the nodes of an ExpressionGraph, mapping node index to node properties."""
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return NodeView(self.graph, key)
+
+    def __contains__(self, key):
+        return isinstance(key, (int, numpy.integer)) and 0 <= key < self.graph.number_of_nodes()
+
+    def __iter__(self):
+        return iter(range(self.graph.number_of_nodes()))
+
+    def __len__(self):
+        return self.graph.number_of_nodes()
+
+
+class NodeView(collections.abc.MutableMapping):
+    """Dict-like view of the properties of a single node."""
+
+    __slots__ = ("graph", "index")
+
+    def __init__(self, graph, index):
+        self.graph = graph
+        self.index = index
+
+    def __getitem__(self, name):
+        G, i = self.graph, self.index
+        if name == "expression":
+            return G.expressions[i]
+        elif name == "status":
+            code = G._status[i]
+            if code < 0:
+                raise KeyError(name)
+            return G.statuses[code]
+        values = G._properties.get(name)
+        if values is None or i not in values:
+            raise KeyError(name)
+        return values[i]
+
+    def __setitem__(self, name, value):
+        G, i = self.graph, self.index
+        if name == "expression":
+            G.expressions[i] = value
+        elif name == "status":
+            G._status[i] = G.statuses.index(value)
+        else:
+            if name == "target":
+                G._target[i] = True
+            G._properties.setdefault(name, {})[i] = value
+
+    def __delitem__(self, name):
+        G, i = self.graph, self.index
+        if name == "expression":
+            raise KeyError("Cannot delete node expression")
+        elif name == "status":
+            if G._status[i] < 0:
+                raise KeyError(name)
+            G._status[i] = -1
+        else:
+            del G._properties.get(name, {})[i]
+            if name == "target":
+                G._target[i] = False
+
+    def __iter__(self):
+        G, i = self.graph, self.index
+        yield "expression"
+        if G._status[i] >= 0:
+            yield "status"
+        for name, values in G._properties.items():
+            if i in values:
+                yield name
+
+    def __len__(self):
+        return sum(1 for name in self)
+
+
+class EdgesView(collections.abc.Mapping):
+    """Dict-like view of the out edges (or in edges) of an ExpressionGraph, mapping node index to list of nodes."""
+
+    def __init__(self, graph, reverse):
+        self.graph = graph
+        self.reverse = reverse
+
+    def __getitem__(self, key):
+        if key not in self.graph.nodes:
+            raise KeyError(key)
+        offsets, indices = self.graph.edges_csr(self.reverse)
+        return indices[offsets[key]:offsets[key + 1]].tolist()
+
+    def __iter__(self):
+        return iter(self.graph.nodes)
+
+    def __len__(self):
+        return len(self.graph.nodes)
 
 
 def build_graph_vertices(expressions, skip_terminal_modifiers=False):
@@ -84,8 +261,7 @@ def build_scalar_graph(expression):
 
     # Compute graph edges
     V_deps = []
-    for i, v in G.nodes.items():
-        expr = v['expression']
+    for expr in G.expressions:
         if expr._ufl_is_terminal_ or expr._ufl_is_terminal_modifier_:
             V_deps.append(())
         else:
@@ -129,8 +305,7 @@ def rebuild_with_scalar_subexpressions(G):
     W = numpy.empty(total_unique_symbols, dtype=object)
 
     # Iterate over each graph node in order
-    for i, v in G.nodes.items():
-        expr = v['expression']
+    for i, expr in enumerate(G.expressions):
         # Find symbols of v components
         vs = V_symbols[i]
 
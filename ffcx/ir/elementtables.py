@@ -5,8 +5,12 @@
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 """Tools for precomputed tables of terminal values."""
 
+import bisect
 import collections
+import functools
+import hashlib
 import logging
+import threading
 
 import numpy
 
@@ -24,7 +28,7 @@ default_rtol = 1e-5
 default_atol = 1e-8
 
 table_origin_t = collections.namedtuple(
-    "table_origin", ["element", "avg", "derivatives", "flat_component", "dofrange", "dofmap"])
+    "table_origin_t", ["element", "avg", "derivatives", "flat_component", "dofrange", "dofmap"])
 
 piecewise_ttypes = ("piecewise", "fixed", "ones", "zeros")
 uniform_ttypes = ("fixed", "ones", "zeros", "uniform")
@@ -32,8 +36,56 @@ uniform_ttypes = ("fixed", "ones", "zeros", "uniform")
 valid_ttypes = set(("quadrature", )) | set(
     piecewise_ttypes) | set(uniform_ttypes)
 
+# Tabulated basis functions, shared by all integrals and compilations of
+# the process, in least-recently-used order. Maps (basix element, points
+# key) to (derivative order, tables). Guarded by _tabulation_cache_lock,
+# as compilations may run in several threads.
+_tabulation_cache = collections.OrderedDict()
+_tabulation_cache_size = 512
+_tabulation_cache_lock = threading.Lock()
+
+
+def clear_tabulation_cache():
+    """Remove all tabulated basis functions from the cache."""
+    with _tabulation_cache_lock:
+        _tabulation_cache.clear()
+
+
+def tabulate(basix_element, deriv_order, points):
+    """Tabulate basix_element and its derivatives at points, reusing earlier tabulations.
+
+    Returns the tables of basix_element.tabulate, to be indexed with
+    basix_index. Derivatives of a higher order than deriv_order may be
+    included, so each element is tabulated once at the highest order
+    needed and every derivative and component is sliced from that.
+    """
+    points = numpy.ascontiguousarray(points, dtype=numpy.float64)
+    key = (basix_element, points.shape, hashlib.blake2b(points.tobytes(), digest_size=16).digest())
+    with _tabulation_cache_lock:
+        entry = _tabulation_cache.get(key)
+        if entry is not None and entry[0] >= deriv_order:
+            _tabulation_cache.move_to_end(key)
+            return entry[1]
+
+    # Tabulate without holding the lock, a concurrent tabulation of the
+    # same element only costs time
+    tables = basix_element.tabulate(deriv_order, points)
+    with _tabulation_cache_lock:
+        # Keep a higher order tabulation stored meanwhile
+        entry = _tabulation_cache.get(key)
+        if entry is None or entry[0] < deriv_order:
+            _tabulation_cache[key] = (deriv_order, tables)
+        _tabulation_cache.move_to_end(key)
+        while len(_tabulation_cache) > _tabulation_cache_size:
+            _tabulation_cache.popitem(last=False)
+    return tables
+
+
+table_analysis_t = collections.namedtuple(
+    "table_analysis_t", ["ttype", "dofrange", "dofmap", "table", "is_permuted"])
+
 unique_table_reference_t = collections.namedtuple(
-    "unique_table_reference",
+    "unique_table_reference_t",
     ["name", "values", "dofrange", "dofmap", "original_dim", "ttype", "is_piecewise", "is_uniform",
      "is_permuted", "dof_base_permutations", "needs_permutation_data"])
 
@@ -55,6 +107,64 @@ def equal_tables(a, b, rtol=default_rtol, atol=default_atol):
         return numpy.allclose(a, b, rtol=rtol, atol=atol)
 
 
+@functools.lru_cache(maxsize=None)
+def _projection_weights(size):
+    weights = numpy.random.RandomState(size).uniform(0.5, 1.0, size)
+    weights.flags.writeable = False
+    return weights
+
+
+class TableIndex:
+    """Index of tables for finding tables equal within tolerance.
+
+    Tables are grouped by shape and sorted by a fixed random projection
+    of their values. Two tables equal within (rtol, atol) have
+    projections differing by at most a bound computed from either of
+    them, so only the tables within that window are compared.
+    """
+
+    def __init__(self, rtol=default_rtol, atol=default_atol):
+        self.rtol = rtol
+        self.atol = atol
+        self._buckets = collections.defaultdict(list)
+        self._entries = {}
+
+    def _project(self, table):
+        table = numpy.asarray(table, dtype=numpy.float64)
+        values = table.reshape(-1)
+        abs_sum = numpy.abs(values).sum()
+        # Bound |p(a) - p(b)| for allclose(a, b) in either argument order,
+        # including rounding errors in the projections
+        tol = (values.size * self.atol + self.rtol * abs_sum) / (1 - self.rtol) \
+            + 4 * values.size * numpy.finfo(float).eps * abs_sum
+        return table.shape, float(values @ _projection_weights(values.size)), tol
+
+    def add(self, key, table, position=None):
+        """Add table under key, ordered by position (defaults to insertion order)."""
+        if position is None:
+            position = len(self._entries)
+        shape, projection, tol = self._project(table)
+        entry = (projection, position, key)
+        bisect.insort(self._buckets[shape], entry)
+        self._entries[key] = (shape, entry, table)
+
+    def remove(self, key):
+        shape, entry, table = self._entries.pop(key)
+        bucket = self._buckets[shape]
+        del bucket[bisect.bisect_left(bucket, entry)]
+
+    def find(self, table):
+        """Return key of the first added table equal to table, or None."""
+        shape, projection, tol = self._project(table)
+        bucket = self._buckets.get(shape, [])
+        begin = bisect.bisect_left(bucket, (projection - tol, ))
+        end = bisect.bisect_right(bucket, (projection + tol, float("inf")))
+        for projection, position, key in sorted(bucket[begin:end], key=lambda entry: entry[1]):
+            if equal_tables(self._entries[key][2], table, rtol=self.rtol, atol=self.atol):
+                return key
+        return None
+
+
 def clamp_table_small_numbers(table,
                               rtol=default_rtol,
                               atol=default_atol,
@@ -74,26 +184,23 @@ def strip_table_zeros(table, block_size, rtol=default_rtol, atol=default_atol):
     sh = table.shape
 
     # Find nonzero columns
-    z = numpy.zeros(sh[:-1])  # Correctly shaped zero table
-    dofmap = tuple(
-        i for i in range(sh[-1]) if not numpy.allclose(z, table[..., i], rtol=rtol, atol=atol))
-    if dofmap:
+    zero_columns = numpy.isclose(0.0, table, rtol=rtol, atol=atol).reshape(-1, sh[-1]).all(axis=0)
+    dofmap = numpy.flatnonzero(~zero_columns)
+    if dofmap.size:
         # Find first nonzero column
-        begin = dofmap[0]
+        begin = int(dofmap[0])
         # Find (one beyond) last nonzero column
-        end = dofmap[-1] + 1
+        end = int(dofmap[-1]) + 1
     else:
         begin = 0
         end = 0
 
-    for i in dofmap:
-        if i % block_size != dofmap[0] % block_size:
-            # If dofs are not all in the same block component, don't remove intermediate zeros
-            dofmap = tuple(range(begin, end))
-            break
-    else:
+    if numpy.all(dofmap % block_size == begin % block_size):
         # If dofs are all in the same block component, keep only that block component
         dofmap = tuple(range(begin, end, block_size))
+    else:
+        # If dofs are not all in the same block component, don't remove intermediate zeros
+        dofmap = tuple(range(begin, end))
 
     # Make subtable by dropping zero columns
     stripped_table = table[..., dofmap]
@@ -114,27 +221,29 @@ def build_unique_tables(tables, rtol=default_rtol, atol=default_atol):
     elif isinstance(tables, dict):
         keys = sorted(tables.keys())
 
+    index = TableIndex(rtol=rtol, atol=atol)
     for k in keys:
         t = tables[k]
-        found = -1
-        for i, u in enumerate(unique):
-            if equal_tables(u, t, rtol=rtol, atol=atol):
-                found = i
-                break
-        if found == -1:
+        i = index.find(t)
+        if i is None:
             i = len(unique)
             unique.append(t)
+            index.add(i, t)
         mapping[k] = i
 
     return unique, mapping
 
 
 def get_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entitytype,
-                          derivative_counts, flat_component):
+                          derivative_counts, flat_component, tabulation_order=0):
     """Extract values from ffcx element table.
 
     Returns a 3D numpy array with axes
     (entity number, quadrature point number, dof number)
+
+    The element is tabulated with derivatives up to at least
+    tabulation_order, so that tables for other derivatives of the same
+    element can be served from the tabulation cache.
     """
     deriv_order = sum(derivative_counts)
 
@@ -185,7 +294,7 @@ def get_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entityt
             entity_points = map_integral_points(
                 points, integral_type, cell, entity)
             # basix
-            tbl = basix_element.tabulate(deriv_order, entity_points)
+            tbl = tabulate(basix_element, max(deriv_order, tabulation_order), entity_points)
             index = basix_index(*derivative_counts)
             tbl = tbl[index].transpose()
 
@@ -200,7 +309,7 @@ def get_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entityt
         for entity in range(num_entities):
             entity_points = map_integral_points(
                 points, integral_type, cell, entity)
-            tbl = basix_element.tabulate(deriv_order, entity_points)
+            tbl = tabulate(basix_element, max(deriv_order, tabulation_order), entity_points)
             tbl = tbl[basix_index(*derivative_counts)]
             sum_sh = sum(sh)
             bshape = (tbl.shape[0],) + sh + (tbl.shape[1] // sum_sh,)
@@ -249,8 +358,7 @@ def get_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entityt
                 points, integral_type, cell, entity)
 
             # basix
-            tbl = component_element.tabulate(
-                deriv_order, entity_points)
+            tbl = tabulate(component_element, max(deriv_order, tabulation_order), entity_points)
             index = basix_index(*derivative_counts)
             tbl = tbl[index].transpose()
 
@@ -376,41 +484,50 @@ def get_modified_terminal_element(mt):
     return element, mt.averaged, local_derivatives, fc
 
 
-def permute_quadrature_interval(points, reflections=0):
-    output = points.copy()
-    for p in output:
-        assert len(p) < 2 or numpy.isclose(p[1], 0)
-        assert len(p) < 3 or numpy.isclose(p[2], 0)
-    for i in range(reflections):
-        for n, p in enumerate(output):
-            output[n] = [1 - p[0]]
+# Affine maps x -> A x + b of one rotation and one reflection of the
+# points on each reference facet
+_facet_rotations = {
+    "interval": (numpy.identity(1), numpy.zeros(1)),
+    "triangle": (numpy.array([[0.0, 1.0], [-1.0, -1.0]]), numpy.array([0.0, 1.0])),
+    "quadrilateral": (numpy.array([[0.0, 1.0], [-1.0, 0.0]]), numpy.array([0.0, 1.0]))}
+_facet_reflections = {
+    "interval": (numpy.array([[-1.0]]), numpy.array([1.0])),
+    "triangle": (numpy.array([[0.0, 1.0], [1.0, 0.0]]), numpy.zeros(2)),
+    "quadrilateral": (numpy.array([[0.0, 1.0], [1.0, 0.0]]), numpy.zeros(2))}
+
+
+@functools.lru_cache(maxsize=None)
+def _facet_permutation_map(facet, reflections, rotations):
+    """Return the affine map (A, b) applying rotations and then reflections to facet points."""
+    tdim = _facet_rotations[facet][0].shape[0]
+    A = numpy.identity(tdim)
+    b = numpy.zeros(tdim)
+    for M, c in [_facet_rotations[facet]] * rotations + [_facet_reflections[facet]] * reflections:
+        A, b = M @ A, M @ b + c
+    A.flags.writeable = False
+    b.flags.writeable = False
+    return A, b
+
+
+def _permute_facet_points(points, facet, reflections, rotations):
+    output = numpy.array(points, dtype=numpy.float64)
+    A, b = _facet_permutation_map(facet, reflections, rotations)
+    tdim = A.shape[0]
+    assert numpy.allclose(output[:, tdim:], 0)
+    output[:, :tdim] = output[:, :tdim] @ A.T + b
     return output
 
 
+def permute_quadrature_interval(points, reflections=0):
+    return _permute_facet_points(points, "interval", reflections, 0)
+
+
 def permute_quadrature_triangle(points, reflections=0, rotations=0):
-    output = points.copy()
-    for p in output:
-        assert len(p) < 3 or numpy.isclose(p[2], 0)
-    for i in range(rotations):
-        for n, p in enumerate(output):
-            output[n] = [p[1], 1 - p[0] - p[1]]
-    for i in range(reflections):
-        for n, p in enumerate(output):
-            output[n] = [p[1], p[0]]
-    return output
+    return _permute_facet_points(points, "triangle", reflections, rotations)
 
 
 def permute_quadrature_quadrilateral(points, reflections=0, rotations=0):
-    output = points.copy()
-    for p in output:
-        assert len(p) < 3 or numpy.isclose(p[2], 0)
-    for i in range(rotations):
-        for n, p in enumerate(output):
-            output[n] = [p[1], 1 - p[0]]
-    for i in range(reflections):
-        for n, p in enumerate(output):
-            output[n] = [p[1], p[0]]
-    return output
+    return _permute_facet_points(points, "quadrilateral", reflections, rotations)
 
 
 def build_element_tables(quadrature_rule,
@@ -451,8 +568,27 @@ def build_element_tables(quadrature_rule,
         ufl.algorithms.analysis.extract_sub_elements(all_elements))
     element_numbers = {element: i for i, element in enumerate(unique_elements)}
 
+    # Highest derivative needed of each element, to tabulate it only once
+    tabulation_orders = collections.defaultdict(int)
+    for element, avg, local_derivatives, flat_component in analysis.values():
+        tabulation_orders[element] = max(tabulation_orders[element], sum(local_derivatives))
+
+    # Quadrature points for each permutation of the facet, shared by
+    # all tables
+    tdim = cell.topological_dimension()
+    points = quadrature_rule.points
+    if entitytype == "facet" and tdim == 2:
+        point_sets = [permute_quadrature_interval(points, ref) for ref in range(2)]
+    elif entitytype == "facet" and cell.cellname() == "tetrahedron":
+        point_sets = [permute_quadrature_triangle(points, ref, rot) for rot in range(3) for ref in range(2)]
+    elif entitytype == "facet" and cell.cellname() == "hexahedron":
+        point_sets = [permute_quadrature_quadrilateral(points, ref, rot) for rot in range(4) for ref in range(2)]
+    else:
+        point_sets = [points]
+
     def add_table(res):
         element, avg, local_derivatives, flat_component = res
+        tabulation_order = 0 if avg else tabulation_orders[element]
 
         # Build name for this particular table
         element_number = element_numbers[element]
@@ -460,52 +596,11 @@ def build_element_tables(quadrature_rule,
                                        local_derivatives, flat_component)
 
         if name not in tables:
-            tdim = cell.topological_dimension()
-            if entitytype == "facet":
-                if tdim == 1:
-                    tables[name] = numpy.array([
-                        get_ffcx_table_values(quadrature_rule.points, cell,
-                                              integral_type, element, avg, entitytype,
-                                              local_derivatives, flat_component)])
-                elif tdim == 2:
-                    # Extract the values of the table from ffc table format
-                    new_table = []
-                    for ref in range(2):
-                        new_table.append(get_ffcx_table_values(
-                            permute_quadrature_interval(
-                                quadrature_rule.points, ref),
-                            cell, integral_type, element, avg, entitytype, local_derivatives, flat_component))
-
-                    tables[name] = numpy.array(new_table)
-                elif tdim == 3:
-                    cell_type = cell.cellname()
-                    if cell_type == "tetrahedron":
-                        # Extract the values of the table from ffc table format
-                        new_table = []
-                        for rot in range(3):
-                            for ref in range(2):
-                                new_table.append(get_ffcx_table_values(
-                                    permute_quadrature_triangle(
-                                        quadrature_rule.points, ref, rot),
-                                    cell, integral_type, element, avg, entitytype, local_derivatives, flat_component))
-
-                        tables[name] = numpy.array(new_table)
-                    elif cell_type == "hexahedron":
-                        # Extract the values of the table from ffc table format
-                        new_table = []
-                        for rot in range(4):
-                            for ref in range(2):
-                                new_table.append(get_ffcx_table_values(
-                                    permute_quadrature_quadrilateral(
-                                        quadrature_rule.points, ref, rot),
-                                    cell, integral_type, element, avg, entitytype, local_derivatives, flat_component))
-
-                        tables[name] = numpy.array(new_table)
-            else:
-                # Extract the values of the table from ffc table format
-                tables[name] = numpy.array([get_ffcx_table_values(quadrature_rule.points, cell,
-                                                                  integral_type, element, avg, entitytype,
-                                                                  local_derivatives, flat_component)])
+            # Extract the values of the table from ffc table format
+            tables[name] = numpy.array([get_ffcx_table_values(points, cell, integral_type, element, avg,
+                                                              entitytype, local_derivatives, flat_component,
+                                                              tabulation_order)
+                                        for points in point_sets])
 
             # Track table origin for custom integrals:
             table_origins[name] = res
@@ -560,12 +655,14 @@ def optimize_element_tables(tables,
     Output:
       unique_tables - { unique_name: stripped_table }
       unique_table_origins - FIXME
+      unique_table_ttypes - { unique_name: table type }
     """
     used_names = sorted(tables)
     compressed_tables = {}
     table_ranges = {}
     table_dofmaps = {}
     table_permuted = {}
+    table_ttypes = {}
     table_original_num_dofs = {}
 
     for name in used_names:
@@ -583,13 +680,13 @@ def optimize_element_tables(tables,
         if isinstance(ufl_element, ufl.VectorElement) or isinstance(ufl_element, ufl.TensorElement):
             block_size = len(ufl_element.sub_elements())
 
-        dofrange, dofmap, tbl = strip_table_zeros(
-            tbl, block_size, rtol=rtol, atol=atol)
+        analysis = analyse_table(tbl, block_size, rtol=rtol, atol=atol)
 
-        compressed_tables[name] = tbl
-        table_ranges[name] = dofrange
-        table_dofmaps[name] = dofmap
-        table_permuted[name] = is_permuted_table(tbl)
+        compressed_tables[name] = analysis.table
+        table_ranges[name] = analysis.dofrange
+        table_dofmaps[name] = analysis.dofmap
+        table_permuted[name] = analysis.is_permuted
+        table_ttypes[name] = analysis.ttype
         table_original_num_dofs[name] = num_dofs
 
     # Build unique table mapping
@@ -610,51 +707,37 @@ def optimize_element_tables(tables,
     # Build mapping from unique table name to the table itself
     unique_tables = {}
     unique_table_origins = {}
+    unique_table_ttypes = {}
     for ui, tbl in enumerate(unique_tables_list):
         uname = unique_names[ui]
         unique_tables[uname] = tbl
         unique_table_origins[uname] = table_origins[uname]
+        unique_table_ttypes[uname] = table_ttypes[uname]
 
-    return unique_tables, unique_table_origins, table_unames, table_ranges, table_dofmaps, table_permuted, \
-        table_original_num_dofs
-
-
-def is_zeros_table(table, rtol=default_rtol, atol=default_atol):
-    return (ufl.utils.sequences.product(table.shape) == 0
-            or numpy.allclose(table, numpy.zeros(table.shape), rtol=rtol, atol=atol))
+    return unique_tables, unique_table_origins, unique_table_ttypes, table_unames, table_ranges, table_dofmaps, \
+        table_permuted, table_original_num_dofs
 
 
 def is_ones_table(table, rtol=default_rtol, atol=default_atol):
-    return numpy.allclose(table, numpy.ones(table.shape), rtol=rtol, atol=atol)
+    return numpy.allclose(table, 1.0, rtol=rtol, atol=atol)
 
 
 def is_quadrature_table(table, rtol=default_rtol, atol=default_atol):
     num_perms, num_entities, num_points, num_dofs = table.shape
-    Id = numpy.eye(num_points)
-    return (num_points == num_dofs and all(
-        numpy.allclose(table[0, i, :, :], Id, rtol=rtol, atol=atol) for i in range(num_entities)))
+    return (num_points == num_dofs
+            and numpy.allclose(table[0, :, :, :], numpy.eye(num_points), rtol=rtol, atol=atol))
 
 
 def is_permuted_table(table, rtol=default_rtol, atol=default_atol):
-    return not all(
-        numpy.allclose(table[0, :, :, :],
-                       table[i, :, :, :], rtol=rtol, atol=atol)
-        for i in range(1, table.shape[0]))
+    return not numpy.allclose(table[:1, :, :, :], table[1:, :, :, :], rtol=rtol, atol=atol)
 
 
 def is_piecewise_table(table, rtol=default_rtol, atol=default_atol):
-    return all(
-        numpy.allclose(table[0, :, 0, :],
-                       table[0, :, i, :], rtol=rtol, atol=atol)
-        for i in range(1, table.shape[2]))
+    return numpy.allclose(table[0, :, :1, :], table[0, :, 1:, :], rtol=rtol, atol=atol)
 
 
-def analyse_table_type(table, rtol=default_rtol, atol=default_atol):
-    num_perms, num_entities, num_points, num_dofs = table.shape
-    if is_zeros_table(table, rtol=rtol, atol=atol):
-        # Table is empty or all values are 0.0
-        ttype = "zeros"
-    elif is_ones_table(table, rtol=rtol, atol=atol):
+def _analyse_nonzero_table_type(table, rtol=default_rtol, atol=default_atol):
+    if is_ones_table(table, rtol=rtol, atol=atol):
         # All values are 1.0
         ttype = "ones"
     elif is_quadrature_table(table, rtol=rtol, atol=atol):
@@ -680,18 +763,99 @@ def analyse_table_type(table, rtol=default_rtol, atol=default_atol):
     return ttype
 
 
+def analyse_table(table, block_size, rtol=default_rtol, atol=default_atol):
+    """Strip zero columns from table and classify the stripped table in one pass."""
+    dofrange, dofmap, table = strip_table_zeros(table, block_size, rtol=rtol, atol=atol)
+    if dofmap:
+        ttype = _analyse_nonzero_table_type(table, rtol=rtol, atol=atol)
+    else:
+        # No nonzero columns are left
+        ttype = "zeros"
+    return table_analysis_t(ttype, dofrange, dofmap, table, is_permuted_table(table))
+
+
 def is_uniform_table(table, rtol=default_rtol, atol=default_atol):
-    return all(
-        numpy.allclose(table[0, 0, :, :],
-                       table[0, i, :, :], rtol=rtol, atol=atol)
-        for i in range(1, table.shape[1]))
+    return numpy.allclose(table[0, :1, :, :], table[0, 1:, :, :], rtol=rtol, atol=atol)
+
 
+def tensor_product_grid(points, atol=default_atol):
+    """Arrange points on a tensor product grid of 1D points.
+
+    Returns an integer array with the shape of the grid holding the
+    index of the point at each position of the grid, or None if the
+    points are not a tensor product grid.
+    """
+    num_points, tdim = points.shape
+    positions = numpy.empty(points.shape, dtype=int)
+    shape = []
+    for d in range(tdim):
+        coordinates = numpy.sort(points[:, d])
+        coordinates = coordinates[numpy.concatenate(([True], numpy.diff(coordinates) > atol))]
+        positions[:, d] = numpy.abs(points[:, d, None] - coordinates[None, :]).argmin(axis=1)
+        shape.append(len(coordinates))
+    grid = numpy.full(shape, -1, dtype=int)
+    grid[tuple(positions.T)] = numpy.arange(num_points)
+    if grid.size != num_points or (grid < 0).any():
+        return None
+    return grid
+
+
+def _separate(values, rtol, atol):
+    """Return vectors whose outer product is values, or None."""
+    m = numpy.unravel_index(numpy.argmax(numpy.abs(values)), values.shape)
+    if values[m] == 0.0:
+        return None
+    factors = [values[m[:d] + (slice(None), ) + m[d + 1:]] for d in range(values.ndim)]
+    factors = factors[:1] + [f / values[m] for f in factors[1:]]
+    if not numpy.allclose(functools.reduce(numpy.multiply.outer, factors), values, rtol=rtol, atol=atol):
+        return None
+    return factors
 
-def analyse_table_types(unique_tables, rtol=default_rtol, atol=default_atol):
-    return {
-        uname: analyse_table_type(table, rtol=rtol, atol=atol)
-        for uname, table in unique_tables.items()
-    }
+
+def factorize_table(table, grid, rtol=1e-8, atol=1e-10):
+    """Factorize a table of basis functions on a tensor product grid of points.
+
+    Each basis function of the table, with dimensions [points][dofs], is
+    written as a scaled product of 1D functions on the 1D points in each
+    direction of the grid from tensor_product_grid. Returns the tables
+    of the distinct 1D functions, with dimensions [points][functions],
+    the position of the 1D functions of each dof in these tables and
+    the scale of each dof, such that table[grid[q0, q1, ...], i] is
+    scales[i] * factors[0][q0, positions[i, 0]] * factors[1][q1, positions[i, 1]] * ...,
+    or None if the table does not factorize.
+    """
+    num_points, num_dofs = table.shape
+    atol *= max(numpy.abs(table).max(), 1.0)
+
+    # Separate each basis function into 1D functions, scaled to one at
+    # their first largest value
+    functions = [[] for d in range(grid.ndim)]
+    positions = numpy.empty((num_dofs, grid.ndim), dtype=int)
+    scales = numpy.ones(num_dofs)
+    for i in range(num_dofs):
+        factors = _separate(table[grid, i], rtol, atol)
+        if factors is None:
+            return None
+        for d, f in enumerate(factors):
+            f0 = f[numpy.argmax(numpy.abs(f) >= (1.0 - 1e-8) * numpy.abs(f).max())]
+            f = f / f0
+            scales[i] *= f0
+            for k, g in enumerate(functions[d]):
+                if numpy.allclose(f, g, rtol=rtol, atol=atol):
+                    break
+            else:
+                k = len(functions[d])
+                functions[d].append(f)
+            positions[i, d] = k
+    factors = [numpy.array(f).T for f in functions]
+
+    # Check the factorization of the whole table
+    product = scales * functools.reduce(
+        numpy.multiply, (f[:, positions[:, d]].reshape((1, ) * d + (-1, ) + (1, ) * (grid.ndim - d - 1) + (num_dofs, ))
+                         for d, f in enumerate(factors)))
+    if not numpy.allclose(product, table[grid], rtol=rtol, atol=atol):
+        return None
+    return factors, positions, scales
 
 
 def build_optimized_tables(quadrature_rule,
@@ -714,18 +878,14 @@ def build_optimized_tables(quadrature_rule,
         atol=atol)
 
     # Optimize tables and get table name and dofrange for each modified terminal
-    unique_tables, unique_table_origins, table_unames, table_ranges, table_dofmaps, table_permuted, \
-        table_original_num_dofs = optimize_element_tables(
+    unique_tables, unique_table_origins, unique_table_ttypes, table_unames, table_ranges, table_dofmaps, \
+        table_permuted, table_original_num_dofs = optimize_element_tables(
             tables, table_origins, rtol=rtol, atol=atol)
 
     # Get num_dofs for all tables before they can be deleted later
     unique_table_num_dofs = {uname: tbl.shape[-1]
                              for uname, tbl in unique_tables.items()}
 
-    # Analyze tables for properties useful for optimization
-    unique_table_ttypes = analyse_table_types(
-        unique_tables, rtol=rtol, atol=atol)
-
     # Compress tables that are constant along num_entities or num_points
     for uname, tabletype in unique_table_ttypes.items():
         if tabletype in piecewise_ttypes:
@@ -748,17 +908,16 @@ def build_optimized_tables(quadrature_rule,
     # Change tables to point to existing optimized tables
     # (i.e. tables from other contexts that have been compressed to look the same)
     name_map = {}
-    existing_names = sorted(existing_tables)
+    existing_index = TableIndex(rtol=rtol, atol=atol)
+    for ename in sorted(existing_tables):
+        existing_index.add(ename, existing_tables[ename])
     for uname in sorted(unique_tables):
-        utbl = unique_tables[uname]
-        for i, ename in enumerate(existing_names):
-            etbl = existing_tables[ename]
-            if equal_tables(utbl, etbl, rtol=rtol, atol=atol):
-                # Setup table name mapping
-                name_map[uname] = ename
-                # Don't visit this table again (just to avoid the processing)
-                existing_names.pop(i)
-                break
+        ename = existing_index.find(unique_tables[uname])
+        if ename is not None:
+            # Setup table name mapping
+            name_map[uname] = ename
+            # Don't visit this table again (just to avoid the processing)
+            existing_index.remove(ename)
 
     # Replace unique table names
     for uname, ename in name_map.items():
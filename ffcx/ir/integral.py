@@ -18,7 +18,9 @@ from ffcx.ir.analysis.graph import build_scalar_graph
 from ffcx.ir.analysis.modified_terminals import (
     analyse_modified_terminal, is_modified_terminal)
 from ffcx.ir.analysis.visualise import visualise_graph
-from ffcx.ir.elementtables import build_optimized_tables
+from ffcx.ir.elementtables import (TableIndex, build_optimized_tables,
+                                   clamp_table_small_numbers, factorize_table,
+                                   tensor_product_grid)
 from ufl.algorithms.balancing import balance_modifiers
 from ufl.checks import is_cellwise_constant
 from ufl.classes import QuadratureWeight
@@ -38,9 +40,26 @@ block_data_t = collections.namedtuple("block_data_t",
                                        "name",  # used in "preintegrated" and "premultiplied"
                                        "ma_data",  # used in "full", "safe" and "partial"
                                        "piecewise_ma_index",  # used in "partial"
-                                       "is_permuted"  # Do quad points on facets need to be permuted?
+                                       "is_permuted",  # Do quad points on facets need to be permuted?
+                                       "sum_factorization"  # sum_factorization_t, or None
                                        ])
 
+# Factorization of the argument tables of a block on a tensor product
+# grid of quadrature points, see elementtables.factorize_table
+sum_factorization_t = collections.namedtuple("sum_factorization_t",
+                                             ["points",  # index of the point at each position of the grid
+                                              "factors",  # names of the 1D tables in each direction, per argument
+                                              "positions",  # position of each dof in the 1D tables, per argument
+                                              "scales"  # scale of each dof, per argument
+                                              ])
+
+# Cells with tensor product quadrature rules
+tensor_product_cells = ("quadrilateral", "hexahedron")
+
+# Integral types with the same quadrature points for the arguments of
+# all blocks, which can be preintegrated
+preintegrated_integral_types = ("cell", "exterior_facet")
+
 
 def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_shape,
                         p, visualise):
@@ -62,6 +81,17 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
     ir["needs_permutation_data"] = 0
     ir["table_needs_permutation_data"] = {}
 
+    # Only bilinear forms with square element tensors can be symmetric
+    ir["symmetric"] = (p["symmetry"] and len(argument_shape) == 2
+                       and argument_shape[0] == argument_shape[1])
+
+    # Tables of 1D functions for sum factorization
+    factor_index = TableIndex(rtol=p["table_rtol"], atol=p["table_atol"])
+
+    # Names of the preintegrated tables of blocks, by the names of
+    # their argument tables
+    preintegrated_tables = {}
+
     for quadrature_rule, integrand in integrands.items():
 
         expression = integrand
@@ -103,12 +133,8 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
             ir["table_dof_base_permutations"][td.name] = td.dof_base_permutations
             ir["table_dofmaps"][td.name] = td.dofmap
 
-        S_targets = [i for i, v in S.nodes.items() if v.get('target', False)]
-
-        if 'zeros' in unique_table_types.values() and len(S_targets) == 1:
+        if 'zeros' in unique_table_types.values():
             # If there are any 'zero' tables, replace symbolically and rebuild graph
-            #
-            # TODO: Implement zero table elimination for non-scalar graphs
             for i, mt in initial_terminals.items():
                 # Set modified terminals with zero tables to zero
                 tr = mt_unique_table_reference.get(mt)
@@ -116,15 +142,25 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
                     S.nodes[i]['expression'] = ufl.as_ufl(0.0)
 
             # Propagate expression changes using dependency list
-            for i, v in S.nodes.items():
-                deps = [S.nodes[j]['expression'] for j in S.out_edges[i]]
+            for i, v in enumerate(S.expressions):
+                deps = [S.expressions[j] for j in S.out_edges[i]]
                 if deps:
-                    v['expression'] = v['expression']._ufl_expr_reconstruct_(*deps)
+                    S.expressions[i] = v._ufl_expr_reconstruct_(*deps)
 
             # Rebuild scalar target expressions and graph (this may be
             # overkill and possible to optimize away if it turns out to be
             # costly)
-            expression = S.nodes[S_targets[0]]['expression']
+            components = {}
+            for i in S.target_nodes():
+                for comp in S.nodes[i]['component']:
+                    components[comp] = S.expressions[i]
+            scalar_expressions = [components[comp] for comp in range(len(components))]
+            if len(scalar_expressions) == 1:
+                expression = scalar_expressions[0]
+            else:
+                # The flattened components of the vector are the
+                # components of the original expression
+                expression = ufl.as_vector(scalar_expressions)
 
             # Rebuild scalar list-based graph representation
             S = build_scalar_graph(expression)
@@ -180,6 +216,14 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
         # Attach 'status' to each node: 'inactive', 'piecewise' or 'varying'
         analyse_dependencies(F, mt_unique_table_reference)
 
+        # Sum factorization applies to cell integrals with quadrature
+        # points on a tensor product grid
+        grid = None
+        if (p["sum_factorization"] and integral_type == "cell"
+                and cell.cellname() in tensor_product_cells):
+            grid = tensor_product_grid(quadrature_rule.points)
+        table_factorizations = {}
+
         # Loop over factorization terms
         block_contributions = collections.defaultdict(list)
         for ma_indices, fi_ci in sorted(argument_factorization.items()):
@@ -216,13 +260,47 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
             for i, ma in enumerate(ma_indices):
                 ma_data.append(ma_data_t(ma, trs[i]))
 
-            block_is_transposed = False  # FIXME: Handle transposes for these block types
+            block_is_transposed = False
+
+            # Blocks with piecewise factors are integrated here, and
+            # the element tensor is the factor times the integral
+            block_name = None
+            if (p["preintegration"] and all_factors_piecewise and rank > 0 and not block_is_permuted
+                    and integral_type in preintegrated_integral_types):
+                block_name = preintegrated_tables.get(unames)
+                if block_name is None and rank == 2:
+                    # Reuse the table of the transposed block
+                    block_name = preintegrated_tables.get(unames[::-1])
+                    block_is_transposed = block_name is not None
+                if block_name is None:
+                    block_name = f"PI{len(preintegrated_tables)}"
+                    preintegrated_tables[unames] = block_name
+                    ptable = integrate_block(quadrature_rule.weights, [unique_tables[n] for n in unames])
+                    ir["unique_tables"][block_name] = clamp_table_small_numbers(
+                        ptable, rtol=p["table_rtol"], atol=p["table_atol"])
+                    ir["unique_table_types"][block_name] = "preintegrated"
+                    ir["table_needs_permutation_data"][block_name] = int(any(
+                        ir["table_needs_permutation_data"][n] for n in unames))
+                    ir["table_dof_base_permutations"][block_name] = tuple(
+                        ir["table_dof_base_permutations"][n] for n in unames)
+
+            block_sum_factorization = None
+            if block_name is None and grid is not None and rank > 0 and not block_is_permuted and \
+                    all(tt in ("uniform", "varying") for tt in ttypes):
+                for uname in unames:
+                    if uname not in table_factorizations:
+                        table_factorizations[uname] = factorize_sum_table(
+                            uname, unique_tables[uname], grid, factor_index, ir)
+                factorizations = [table_factorizations[uname] for uname in unames]
+                if all(f is not None for f in factorizations):
+                    block_sum_factorization = sum_factorization_t(grid, *zip(*factorizations))
 
             block_unames = unames
             blockdata = block_data_t(ttypes, fi_ci,
                                      all_factors_piecewise, block_unames,
                                      block_restrictions, block_is_transposed,
-                                     block_is_uniform, None, tuple(ma_data), None, block_is_permuted)
+                                     block_is_uniform, block_name, tuple(ma_data), None, block_is_permuted,
+                                     block_sum_factorization)
 
             # Insert in expr_ir for this quadrature loop
             block_contributions[blockmap].append(blockdata)
@@ -238,6 +316,13 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
         for blockmap, contributions in itertools.chain(
                 block_contributions.items()):
             for blockdata in contributions:
+                if blockdata.name is not None:
+                    active_table_names.add(blockdata.name)
+                    continue
+                if blockdata.sum_factorization is not None:
+                    for names in blockdata.sum_factorization.factors:
+                        active_table_names.update(names)
+                    continue
                 for mad in blockdata.ma_data:
                     active_table_names.add(mad.tabledata.name)
 
@@ -270,6 +355,17 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
             if mt and F.nodes[i]['status'] != 'inactive':
                 active_mts.append(mt)
 
+        # The element tensor is symmetric if each block has a transposed
+        # block with the same factor
+        block_keys = collections.Counter()
+        for blockmap, contributions in block_contributions.items():
+            for blockdata in contributions:
+                block_keys[(blockmap, blockdata.unames, blockdata.restrictions,
+                            tuple(blockdata.factor_indices_comp_indices))] += 1
+        if any(block_keys[(key[0][::-1], key[1][::-1], key[2][::-1], key[3])] != count
+               for key, count in block_keys.items()):
+            ir["symmetric"] = False
+
         # Build IR dict for the given expressions
         # Store final ir for this num_points
         ir["integrand"][quadrature_rule] = {"factorization": F,
@@ -278,6 +374,50 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
     return ir
 
 
+def integrate_block(weights, tables):
+    """Integrate the product of the tables of the arguments of a block.
+
+    The tables have dimensions [permutation][entities][points][dofs],
+    and may be reduced to one entity or point. Returns the integrals
+    with dimensions [permutation][entities][dofs0][dofs1]...
+    """
+    num_entities = max(table.shape[1] for table in tables)
+    num_points = len(weights)
+    tables = [numpy.broadcast_to(table[0], (num_entities, num_points, table.shape[-1])) for table in tables]
+    indices = "ijkl"[:len(tables)]
+    subscripts = ",".join(["q"] + [f"eq{i}" for i in indices]) + "->e" + indices
+    return numpy.einsum(subscripts, weights, *tables)[numpy.newaxis]
+
+
+def factorize_sum_table(name, table, grid, factor_index, ir):
+    """Factorize a table for sum factorization, adding its 1D tables to the IR.
+
+    Returns the names of the 1D tables, the positions and the scales of
+    the dofs, or None if the table does not factorize.
+    """
+    if table.shape[:2] != (1, 1):
+        return None
+    factorization = factorize_table(table[0, 0], grid)
+    if factorization is None:
+        return None
+    factors, positions, scales = factorization
+
+    # Reuse equal 1D tables, which are shared by the tables of an
+    # element and its derivatives
+    names = []
+    for d, factor in enumerate(factors):
+        factor = factor[numpy.newaxis, numpy.newaxis]
+        fname = factor_index.find(factor)
+        if fname is None:
+            fname = f"{name}_F{d}"
+            factor_index.add(fname, factor)
+            ir["unique_tables"][fname] = factor
+            ir["unique_table_types"][fname] = "uniform"
+            ir["table_needs_permutation_data"][fname] = 0
+        names.append(fname)
+    return tuple(names), positions, scales
+
+
 def analyse_dependencies(F, mt_unique_table_reference):
     # Sets 'status' of all nodes to either: 'inactive', 'piecewise' or 'varying'
     # Children of 'target' nodes are either 'piecewise' or 'varying'.
@@ -286,16 +426,7 @@ def analyse_dependencies(F, mt_unique_table_reference):
     # nodes are also set to 'varying' - any remaining active nodes are 'piecewise'.
 
     # Set targets, and dependencies to 'active'
-    targets = [i for i, v in F.nodes.items() if v.get('target')]
-    for i, v in F.nodes.items():
-        v['status'] = 'inactive'
-
-    while targets:
-        s = targets.pop()
-        F.nodes[s]['status'] = 'active'
-        for j in F.out_edges[s]:
-            if F.nodes[j]['status'] == 'inactive':
-                targets.append(j)
+    active = F.reachable(F.target_nodes())
 
     # Build piecewise/varying markers for factorized_vertices
     varying_ttypes = ("varying", "quadrature", "uniform")
@@ -319,18 +450,13 @@ def analyse_dependencies(F, mt_unique_table_reference):
             # not sure which cases this will cover (if any)
             # varying_indices.append(i)
 
-    # Set all parents of active varying nodes to 'varying'
-    while varying_indices:
-        s = varying_indices.pop()
-        if F.nodes[s]['status'] == 'active':
-            F.nodes[s]['status'] = 'varying'
-            for j in F.in_edges[s]:
-                varying_indices.append(j)
+    # Set all active parents of active varying nodes to 'varying'
+    varying = F.reachable(varying_indices, reverse=True, mask=active)
 
     # Any remaining active nodes must be 'piecewise'
-    for i, v in F.nodes.items():
-        if v['status'] == 'active':
-            v['status'] = 'piecewise'
+    F.status[:] = numpy.select([varying, active],
+                               [F.statuses.index('varying'), F.statuses.index('piecewise')],
+                               F.statuses.index('inactive'))
 
 
 def replace_quadratureweight(expression):
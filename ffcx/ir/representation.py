@@ -29,6 +29,7 @@ from ffcx.basix_interface import create_basix_element
 from ffcx.ir.integral import compute_integral_ir
 from ffcx.ir.representationutils import (QuadratureRule,
                                          create_quadrature_points_and_weights)
+from ffcx.parallel import parallel_map
 from ufl.classes import Integral
 from ufl.sorting import sorted_expr_sum
 
@@ -67,7 +68,7 @@ ir_integral = namedtuple('ir_integral', [
     'element_ids', 'tensor_shape', 'coefficient_numbering', 'coefficient_offsets',
     'original_constant_offsets', 'params', 'cell_shape', 'unique_tables', 'unique_table_types',
     'table_dofmaps', 'table_dof_base_permutations', 'integrand', 'name', 'precision',
-    'table_needs_permutation_data', 'needs_permutation_data'])
+    'table_needs_permutation_data', 'needs_permutation_data', 'symmetric'])
 ir_evaluate_dof = namedtuple('ir_evaluate_dof', [
     'mappings', 'reference_value_size', 'physical_value_size', 'geometric_dimension',
     'topological_dimension', 'dofs', 'cell_shape'])
@@ -75,14 +76,18 @@ ir_expression = namedtuple('ir_expression', [
     'name', 'element_dimensions', 'params', 'unique_tables', 'unique_table_types', 'integrand',
     'table_dofmaps', 'table_dof_base_permutations', 'coefficient_numbering', 'coefficient_offsets',
     'integral_type', 'entitytype', 'tensor_shape', 'expression_shape', 'original_constant_offsets',
-    'original_coefficient_positions', 'points', 'table_needs_permutation_data', 'needs_permutation_data'])
+    'original_coefficient_positions', 'points', 'table_needs_permutation_data', 'needs_permutation_data',
+    'symmetric'])
 
 ir_data = namedtuple('ir_data', ['elements', 'dofmaps', 'coordinate_mappings', 'integrals', 'forms', 'expressions'])
 
 
-def compute_ir(analysis: namedtuple, object_names, prefix, parameters, visualise):
+def compute_ir(analysis: namedtuple, object_names, prefix, parameters, visualise, jobs=1):
     """Compute intermediate representation.
 
+    The IR of the integrals is computed in a pool of jobs processes if
+    jobs > 1.
+
     """
 
     logger.info(79 * "*")
@@ -121,7 +126,14 @@ def compute_ir(analysis: namedtuple, object_names, prefix, parameters, visualise
         _compute_integral_ir(fd, i, prefix, analysis.element_numbers, integral_names, parameters, visualise)
         for (i, fd) in enumerate(analysis.form_data)
     ]
-    ir_integrals = list(itertools.chain(*irs))
+    irs = list(itertools.chain(*irs))
+
+    # The integral IR is computed independently for each integral
+    integral_irs = parallel_map(compute_integral_ir, [args for ir, args in irs], jobs)
+    ir_integrals = []
+    for (ir, args), integral_ir in zip(irs, integral_irs):
+        ir.update(integral_ir)
+        ir_integrals.append(ir_integral(**ir))
 
     ir_forms = [
         _compute_form_ir(fd, i, prefix, analysis.element_numbers, finite_element_names,
@@ -173,11 +185,7 @@ def _compute_element_ir(ufl_element, element_numbers, finite_element_names, epsi
     else:
         ir["block_size"] = 1
 
-    im = basix_element.interpolation_matrix
-    if im.shape[0] == im.shape[1] and numpy.allclose(im, numpy.identity(im.shape[0])):
-        ir["interpolation_is_identity"] = 1
-    else:
-        ir["interpolation_is_identity"] = 0
+    ir["interpolation_is_identity"] = int(basix_element.interpolation_is_identity)
 
     ir["base_permutations"] = basix_element.base_permutations
     ir["needs_permutation_data"] = 0
@@ -348,7 +356,11 @@ def _compute_coordinate_mapping_ir(ufl_coordinate_element,
 
 def _compute_integral_ir(form_data, form_index, prefix, element_numbers, integral_names,
                          parameters, visualise):
-    """Compute intermediate represention for form integrals."""
+    """Compute intermediate represention for form integrals.
+
+    Returns a list of the IR of each integral, without the data computed
+    by compute_integral_ir, and the arguments to compute_integral_ir.
+    """
 
     _entity_types = {
         "cell": "cell",
@@ -502,17 +514,14 @@ def _compute_integral_ir(form_data, form_index, prefix, element_numbers, integra
         # Create map from number of quadrature points -> integrand
         integrands = {rule: integral.integrand() for rule, integral in sorted_integrals.items()}
 
-        # Build more specific intermediate representation
-        integral_ir = compute_integral_ir(itg_data.domain.ufl_cell(), itg_data.integral_type,
-                                          ir["entitytype"], integrands, ir["tensor_shape"],
-                                          parameters, visualise)
-
-        ir.update(integral_ir)
-
         # Fetch name
         ir["name"] = integral_names[(form_index, itg_data_index)]
 
-        irs.append(ir_integral(**ir))
+        # Arguments for building more specific intermediate representation
+        args = (itg_data.domain.ufl_cell(), itg_data.integral_type, ir["entitytype"], integrands,
+                ir["tensor_shape"], parameters, visualise)
+
+        irs.append((ir, args))
 
     return irs
 
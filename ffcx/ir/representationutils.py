@@ -31,6 +31,13 @@ class QuadratureRule:
     def __eq__(self, other):
         return numpy.allclose(self.points, other.points) and numpy.allclose(self.weights, other.weights)
 
+    def __getstate__(self):
+        # Hash objects cannot be pickled, the hash is recomputed on demand
+        state = self.__dict__.copy()
+        state.pop("hash_obj", None)
+        state["_hash"] = None
+        return state
+
     def id(self):
         """Returns unique deterministic identifier.
 
@@ -10,10 +10,14 @@ Parse command-line arguments and generate code from input UFL form files.
 
 import argparse
 import cProfile
+import json
 import logging
 import pathlib
 import re
+import shlex
 import string
+import sys
+import tempfile
 
 import ufl
 from ffcx import __version__ as FFCX_VERSION
@@ -23,12 +27,19 @@ from ffcx.parameters import FFCX_DEFAULT_PARAMETERS, get_parameters
 logger = logging.getLogger("ffcx")
 
 parser = argparse.ArgumentParser(
-    description="FEniCS Form Compiler (FFCX, https://fenicsproject.org)")
+    description="FEniCS Form Compiler (FFCX, https://fenicsproject.org)",
+    epilog="Run 'ffcx cache --help' to inspect and prune JIT cache directories, "
+    "and 'ffcx bundle --help' to precompile forms for the JIT.")
 parser.add_argument(
     "--version", action='version', version=f"%(prog)s (version {FFCX_VERSION})")
 parser.add_argument("-o", "--output-directory", type=str, default=".", help="output directory")
 parser.add_argument("--visualise", action="store_true", help="visualise the IR graph")
 parser.add_argument("-p", "--profile", action='store_true', help="enable profiling")
+parser.add_argument("-j", "--jobs", type=int, default=1,
+                    help="number of processes computing the IR of and generating code for integrals")
+parser.add_argument("--ir-cache-dir", type=str,
+                    help="cache the intermediate representation in this directory, so that recompiling "
+                    "with changed code generation parameters skips analysis and IR computation")
 
 # Add all parameters from FFC parameter system
 for param_name, (param_val, param_desc) in FFCX_DEFAULT_PARAMETERS.items():
@@ -38,7 +49,99 @@ for param_name, (param_val, param_desc) in FFCX_DEFAULT_PARAMETERS.items():
 parser.add_argument("ufl_file", nargs='+', help="UFL file(s) to be compiled")
 
 
+def _parse_size(size):
+    """Parse a size in bytes, with an optional K, M or G suffix."""
+    units = {"K": 2**10, "M": 2**20, "G": 2**30}
+    try:
+        if size[-1:].upper() in units:
+            return int(float(size[:-1]) * units[size[-1:].upper()])
+        return int(size)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: '{size}'")
+
+
+cache_parser = argparse.ArgumentParser(
+    prog="ffcx cache", description="Inspect and prune an FFCX JIT cache directory")
+cache_parser.add_argument("action", choices=["stats", "prune", "clear"],
+                          help="show statistics, evict least recently used entries, or remove all entries")
+cache_parser.add_argument("cache_dir", type=str, help="JIT cache directory")
+cache_parser.add_argument("--max-size", type=_parse_size,
+                          help="prune entries until the cache is at most this size (e.g. 500M, 10G)")
+cache_parser.add_argument("--max-age", type=float, help="prune entries not used for this many days")
+
+
+def cache_main(args=None):
+    from ffcx.codegeneration import jit
+
+    xargs = cache_parser.parse_args(args)
+    if xargs.action == "stats":
+        for name, value in jit.cache_stats(xargs.cache_dir).items():
+            print(f"{name}: {value}")
+    elif xargs.action == "prune":
+        if xargs.max_size is None and xargs.max_age is None:
+            cache_parser.error("prune requires --max-size and/or --max-age")
+        max_age = None if xargs.max_age is None else xargs.max_age * 86400
+        removed = jit.prune_cache(xargs.cache_dir, max_size=xargs.max_size, max_age=max_age)
+        print(f"Removed {removed} bytes")
+    else:
+        removed = jit.clear_cache(xargs.cache_dir)
+        print(f"Removed {removed} bytes")
+
+    return 0
+
+
+bundle_parser = argparse.ArgumentParser(
+    prog="ffcx bundle", description="Precompile the forms and elements in UFL files into a JIT bundle archive")
+bundle_parser.add_argument("-o", "--output", type=str, required=True, help="bundle archive to write")
+bundle_parser.add_argument("--parameters", type=str, action="append",
+                           help="JSON file with FFCX parameters to compile with (repeat for several sets)")
+bundle_parser.add_argument("--cffi-extra-compile-args", type=str, default=None,
+                           help="extra C compiler arguments, as passed to the JIT by the application")
+bundle_parser.add_argument("ufl_file", nargs='+', help="UFL file(s) to be compiled")
+
+
+def bundle_main(args=None):
+    from ffcx.codegeneration import jit
+
+    xargs = bundle_parser.parse_args(args)
+
+    parameter_sets = [None]
+    if xargs.parameters is not None:
+        parameter_sets = []
+        for filename in xargs.parameters:
+            with open(filename) as f:
+                parameter_sets.append(json.load(f))
+
+    cffi_extra_compile_args = None
+    if xargs.cffi_extra_compile_args is not None:
+        cffi_extra_compile_args = shlex.split(xargs.cffi_extra_compile_args)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for filename in xargs.ufl_file:
+            ufd = ufl.algorithms.load_ufl_file(filename)
+            for parameters in parameter_sets:
+                # Compile one object per module, as applications request them
+                for form in ufd.forms:
+                    jit.compile_forms([form], parameters=parameters, cache_dir=cache_dir,
+                                      cffi_extra_compile_args=cffi_extra_compile_args)
+                for element in ufd.elements:
+                    jit.compile_elements([element], parameters=parameters, cache_dir=cache_dir,
+                                         cffi_extra_compile_args=cffi_extra_compile_args)
+
+        modules = jit.create_bundle(xargs.output, cache_dir)
+    print(f"Wrote {len(modules)} modules to {xargs.output}")
+
+    return 0
+
+
 def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if args and args[0] == "cache":
+        return cache_main(args[1:])
+    if args and args[0] == "bundle":
+        return bundle_main(args[1:])
+
     xargs = parser.parse_args(args)
 
     # Parse all other parameters
@@ -69,10 +172,12 @@ def main(args=None):
         # Generate code
         if len(ufd.forms) > 0:
             code_h, code_c = compiler.compile_ufl_objects(
-                ufd.forms, ufd.object_names, prefix=prefix, parameters=parameters, visualise=xargs.visualise)
+                ufd.forms, ufd.object_names, prefix=prefix, parameters=parameters, visualise=xargs.visualise,
+                ir_cache_dir=xargs.ir_cache_dir, jobs=xargs.jobs)
         else:
             code_h, code_c = compiler.compile_ufl_objects(
-                ufd.elements, ufd.object_names, prefix=prefix, parameters=parameters, visualise=xargs.visualise)
+                ufd.elements, ufd.object_names, prefix=prefix, parameters=parameters, visualise=xargs.visualise,
+                ir_cache_dir=xargs.ir_cache_dir, jobs=xargs.jobs)
 
         # Write to file
         formatting.write_code(code_h, code_c, prefix, xargs.output_directory)
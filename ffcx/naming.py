@@ -4,12 +4,19 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import functools
 import hashlib
+import weakref
 
 import ffcx
 import ufl
 
 
+# Memoized signatures of UFL objects, keyed on tag. Forms do not
+# support weak references and keep theirs in Form._cache instead.
+_signatures = weakref.WeakKeyDictionary()
+
+
 def compute_signature(ufl_objects, tag, coordinate_mapping=False):
     """Compute the signature hash.
     Based on the UFL type of the objects and an additional optional
@@ -22,63 +29,89 @@ def compute_signature(ufl_objects, tag, coordinate_mapping=False):
     find this information just by looking at type of `ufl_object`
     passed.
 
+    The signature of a single object is memoized on that object.
+
     """
 
-    object_signature = ""
+    memo = None
+    if len(ufl_objects) == 1:
+        memo = _signature_memo(ufl_objects[0])
+        key = (tag, bool(coordinate_mapping))
+        if memo is not None and key in memo:
+            return memo[key]
+
+    h = hashlib.blake2b(digest_size=20)
     for ufl_object in ufl_objects:
-        # Get signature from ufl object
-        if isinstance(ufl_object, ufl.Form):
-            kind = "form"
-            object_signature += ufl_object.signature()
-        elif isinstance(ufl_object, ufl.Mesh):
-            # When coordinate mapping is represented by a Mesh, just getting
-            # its coordinate element
-            object_signature += repr(ufl_object.ufl_coordinate_element())
-            kind = "coordinate_mapping"
-        elif coordinate_mapping and isinstance(ufl_object, ufl.FiniteElementBase):
-            object_signature += repr(ufl_object)
-            kind = "coordinate_mapping"
-        elif isinstance(ufl_object, ufl.FiniteElementBase):
-            object_signature += repr(ufl_object)
-            kind = "element"
-        elif isinstance(ufl_object, tuple) and isinstance(ufl_object[0], ufl.core.expr.Expr):
-            expr = ufl_object[0]
-            points = ufl_object[1]
-
-            # FIXME Move this to UFL, cache the computation
-            coeffs = ufl.algorithms.extract_coefficients(expr)
-            consts = ufl.algorithms.analysis.extract_constants(expr)
-            args = ufl.algorithms.analysis.extract_arguments(expr)
-
-            rn = dict()
-            rn.update(dict((c, i) for i, c in enumerate(coeffs)))
-            rn.update(dict((c, i) for i, c in enumerate(consts)))
-            rn.update(dict((c, i) for i, c in enumerate(args)))
-
-            domains = []
-            for coeff in coeffs:
-                domains.append(*coeff.ufl_domains())
-            for arg in args:
-                domains.append(*arg.ufl_domains())
-            for gc in ufl.algorithms.analysis.extract_type(expr, ufl.classes.GeometricQuantity):
-                domains.append(*gc.ufl_domains())
-
-            domains = ufl.algorithms.analysis.unique_tuple(domains)
-            rn.update(dict((d, i) for i, d in enumerate(domains)))
-
-            # Hash on UFL signature and points
-            signature = ufl.algorithms.signature.compute_expression_signature(expr, rn)
-            object_signature += signature
-            object_signature += repr(points)
-
-            kind = "expression"
-        else:
-            raise RuntimeError(f"Unknown ufl object type {ufl_object.__class__.__name__}")
+        kind, object_signature = _object_signature(ufl_object, coordinate_mapping)
+        h.update((object_signature + ";").encode('utf-8'))
 
     # Build combined signature
-    signatures = [object_signature, str(ffcx.__version__), ffcx.codegeneration.get_signature(), kind, tag]
-    string = ";".join(signatures)
-    return hashlib.sha1(string.encode('utf-8')).hexdigest()
+    signatures = [str(ffcx.__version__), ffcx.codegeneration.get_signature(), kind, tag]
+    h.update(";".join(signatures).encode('utf-8'))
+    signature = h.hexdigest()
+
+    if memo is not None:
+        memo[key] = signature
+    return signature
+
+
+def _signature_memo(ufl_object):
+    """Return the dict of memoized signatures for ufl_object, or None if it cannot hold one."""
+    if isinstance(ufl_object, ufl.Form):
+        return ufl_object._cache.setdefault("ffcx_signatures", {})
+    try:
+        return _signatures.setdefault(ufl_object, {})
+    except TypeError:
+        # Not weakly referenceable, e.g. (expression, points) tuples
+        return None
+
+
+def _object_signature(ufl_object, coordinate_mapping):
+    """Return kind and signature string of a UFL object."""
+    if isinstance(ufl_object, ufl.Form):
+        return "form", ufl_object.signature()
+    elif isinstance(ufl_object, ufl.Mesh):
+        # When coordinate mapping is represented by a Mesh, just getting
+        # its coordinate element
+        return "coordinate_mapping", repr(ufl_object.ufl_coordinate_element())
+    elif coordinate_mapping and isinstance(ufl_object, ufl.FiniteElementBase):
+        return "coordinate_mapping", repr(ufl_object)
+    elif isinstance(ufl_object, ufl.FiniteElementBase):
+        return "element", repr(ufl_object)
+    elif isinstance(ufl_object, tuple) and isinstance(ufl_object[0], ufl.core.expr.Expr):
+        expr = ufl_object[0]
+        points = ufl_object[1]
+
+        # Hash on UFL signature and points
+        return "expression", _expression_signature(expr) + repr(points)
+    else:
+        raise RuntimeError(f"Unknown ufl object type {ufl_object.__class__.__name__}")
+
+
+@functools.lru_cache(maxsize=128)
+def _expression_signature(expr):
+    """Return the UFL signature of an expression, renumbering its terminals."""
+    coeffs = ufl.algorithms.extract_coefficients(expr)
+    consts = ufl.algorithms.analysis.extract_constants(expr)
+    args = ufl.algorithms.analysis.extract_arguments(expr)
+
+    rn = dict()
+    rn.update(dict((c, i) for i, c in enumerate(coeffs)))
+    rn.update(dict((c, i) for i, c in enumerate(consts)))
+    rn.update(dict((c, i) for i, c in enumerate(args)))
+
+    domains = []
+    for coeff in coeffs:
+        domains.append(*coeff.ufl_domains())
+    for arg in args:
+        domains.append(*arg.ufl_domains())
+    for gc in ufl.algorithms.analysis.extract_type(expr, ufl.classes.GeometricQuantity):
+        domains.append(*gc.ufl_domains())
+
+    domains = ufl.algorithms.analysis.unique_tuple(domains)
+    rn.update(dict((d, i) for i, d in enumerate(domains)))
+
+    return ufl.algorithms.signature.compute_expression_signature(expr, rn)
 
 
 def integral_name(integral_type, original_form, form_id, subdomain_id):
@@ -0,0 +1,26 @@
+# Copyright (C) 2021 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Evaluation of compiler stages in a pool of processes."""
+
+import concurrent.futures
+import multiprocessing
+
+
+def parallel_map(function, args, jobs):
+    """Return function applied to each tuple of arguments in order, in a pool of jobs processes if jobs > 1.
+
+    The worker processes are not forked from the calling process, as
+    the JIT compiles in background threads and forking a multithreaded
+    process can deadlock on locks held by other threads. As with any
+    spawned processes, scripts using jobs > 1 must guard their main
+    code with if __name__ == "__main__".
+    """
+    if jobs > 1 and len(args) > 1:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        with concurrent.futures.ProcessPoolExecutor(min(jobs, len(args)), mp_context=context) as executor:
+            return list(executor.map(function, *zip(*args)))
+    return [function(*a) for a in args]
@@ -32,6 +32,19 @@ FFCX_DEFAULT_PARAMETERS = {
                (-1 means no alignment assumed, safe option)"""),
     "padlen":
         (1, "Pads every declared array in tabulation kernel such that its last dimension is divisible by given value."),
+    "preintegration":
+        (True, "Precompute the integrals of the products of basis functions in cell and exterior facet integrals "
+               "for blocks with piecewise constant factors."),
+    "sum_factorization":
+        (True, "Use sum factorization for tensor product elements in cell integrals on quadrilaterals and hexahedra."),
+    "symmetry":
+        (True, "Compute only the upper triangle of symmetric element tensors of bilinear forms."),
+    "batch_kernels":
+        (False, "Generate tabulate_tensor_batch kernels evaluating cell and facet integrals for blocks of cells."),
+    "simd_width":
+        (0, """Number of cells evaluated in lockstep in the batched tabulation kernels, using GCC vector
+               extensions for the local variables. Only used with batch_kernels and the double scalar type.
+               (0 means loops over the cells of a block)"""),
     "verbosity":
         (30, "Logger verbosity. Follows standard logging library levels, i.e. INFO=20, DEBUG=10, etc.")
 }
@@ -19,6 +19,7 @@ else:
     REQUIREMENTS = [
         "numpy",
         "cffi",
+        "setuptools",
         "fenics-basix",
         "fenics-ufl{}".format(RESTRICT_REQUIREMENTS),
     ]
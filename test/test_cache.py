@@ -4,13 +4,18 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import socket
+import subprocess
 import sys
 
+import pytest
+
+import basix
 import ffcx.codegeneration.jit
 import ufl
 
 
-def test_cache_modes(compile_args):
+def test_cache_modes(compile_args, tmp_path):
     cell = ufl.triangle
     element = ufl.FiniteElement("Lagrange", cell, 1)
     u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
@@ -26,10 +31,184 @@ def test_cache_modes(compile_args):
 
     # Load form from cache
     compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
-        forms, cache_dir="./compile-cache", cffi_extra_compile_args=compile_args)
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
     newname = module.__name__
     newfile = module.__file__
     print(newname, newfile)
 
     assert(newname == tmpname)
     assert(newfile != tmpfile)
+
+
+def test_module_registry(compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    ffcx.codegeneration.jit.clear_module_registry()
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(forms, cffi_extra_compile_args=compile_args)
+
+    # Repeated request is served from the in-process registry
+    compiled_forms2, module2 = ffcx.codegeneration.jit.compile_forms(forms, cffi_extra_compile_args=compile_args)
+    assert module2 is module
+    assert compiled_forms2[0] is compiled_forms[0]
+
+    # With the registry disabled, the form is compiled again into a new temporary directory
+    ffcx.codegeneration.jit.set_module_registry_size(0)
+    try:
+        compiled_forms3, module3 = ffcx.codegeneration.jit.compile_forms(
+            forms, cffi_extra_compile_args=compile_args)
+        assert module3.__file__ != module.__file__
+    finally:
+        ffcx.codegeneration.jit.set_module_registry_size(128)
+
+
+def test_compile_lock(tmp_path):
+    lock = ffcx.codegeneration.jit._FileLock(tmp_path / "module.c.lock")
+    lock.acquire(timeout=1)
+
+    # A second waiter gives up while the lock is held...
+    waiter = ffcx.codegeneration.jit._FileLock(tmp_path / "module.c.lock")
+    with pytest.raises(TimeoutError):
+        waiter.acquire(timeout=0.05)
+
+    # ...and gets it as soon as it is released
+    lock.release()
+    waiter.acquire(timeout=0.05)
+    waiter.release()
+
+
+def test_stale_compile_lock(tmp_path, monkeypatch):
+    # Without fcntl, a lock file left by a process which has exited is removed
+    monkeypatch.setattr(ffcx.codegeneration.jit, "fcntl", None)
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    tmp_path.joinpath("module.c.lock").write_text(f"{socket.gethostname()} {process.pid}")
+
+    lock = ffcx.codegeneration.jit._FileLock(tmp_path / "module.c.lock")
+    lock.acquire(timeout=1)
+
+    # A live holder is waited for
+    waiter = ffcx.codegeneration.jit._FileLock(tmp_path / "module.c.lock")
+    with pytest.raises(TimeoutError):
+        waiter.acquire(timeout=0.05)
+    lock.release()
+    assert not tmp_path.joinpath("module.c.lock").exists()
+
+
+def test_get_cached_module(tmp_path):
+    assert ffcx.codegeneration.jit.get_cached_module("libffcx_forms_missing", [], tmp_path, 1) == (None, None)
+
+
+def test_object_cache(compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a0 = ufl.inner(u, v) * ufl.dx
+    a1 = ufl.inner(u, v) * ufl.dx + ufl.inner(u, v) * ufl.ds
+
+    ffcx.codegeneration.jit.compile_forms([a0], cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert len(list(tmp_path.joinpath("objects").glob("*.o"))) == 1
+
+    # The cell kernel of the second form is identical and is reused
+    ffcx.codegeneration.jit.compile_forms([a1], cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert len(list(tmp_path.joinpath("objects").glob("*.o"))) == 2
+
+
+def test_cache_management(compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    ffcx.codegeneration.jit.clear_module_registry()
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    ffcx.codegeneration.jit.clear_module_registry()
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+
+    # Intermediate files are removed after a successful build
+    assert not list(tmp_path.glob("libffcx_*.c"))
+    assert not list(tmp_path.glob("libffcx_*.o"))
+
+    stats = ffcx.codegeneration.jit.cache_stats(tmp_path)
+    assert stats["modules"] == 1
+    assert stats["module_misses"] == 1
+    assert stats["module_hits"] == 1
+    assert stats["bytes"] > 0
+
+    assert ffcx.codegeneration.jit.prune_cache(tmp_path, max_size=stats["bytes"]) == 0
+    assert ffcx.codegeneration.jit.prune_cache(tmp_path, max_size=0) == stats["bytes"]
+    assert ffcx.codegeneration.jit.cache_stats(tmp_path)["modules"] == 0
+    assert not list(tmp_path.glob("libffcx_*.lock"))
+
+    ffcx.codegeneration.jit.clear_cache(tmp_path)
+    assert not list(tmp_path.glob("stats.json*"))
+
+
+def test_bundle(compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path / "build", cffi_extra_compile_args=compile_args)
+    modules = ffcx.codegeneration.jit.create_bundle(tmp_path / "forms.tar.gz", tmp_path / "build")
+    assert len(modules) == 1
+
+    ffcx.codegeneration.jit.clear_module_registry()
+    assert ffcx.codegeneration.jit.load_bundle(tmp_path / "forms.tar.gz", extract_dir=tmp_path / "bundle") == 1
+    try:
+        compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+            forms, cache_dir=tmp_path / "cache", cffi_extra_compile_args=compile_args)
+    finally:
+        ffcx.codegeneration.jit.clear_bundles()
+
+    # The module is loaded from the bundle, without compiling
+    assert module.__name__ == modules[0]
+    assert module.__file__.startswith(str(tmp_path / "bundle"))
+    assert not tmp_path.joinpath("cache").exists()
+
+
+def test_local_cache_tier(compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    # Compiled in the local tier and published to the shared tier
+    ffcx.codegeneration.jit.clear_module_registry()
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path / "shared", local_cache_dir=tmp_path / "node0",
+        cffi_extra_compile_args=compile_args)
+    assert module.__file__.startswith(str(tmp_path / "node0"))
+    assert list(tmp_path.joinpath("shared").glob(module.__name__ + ".c.cached"))
+
+    # Another node copies the module from the shared tier
+    ffcx.codegeneration.jit.clear_module_registry()
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path / "shared", local_cache_dir=tmp_path / "node1",
+        cffi_extra_compile_args=compile_args)
+    assert module.__file__.startswith(str(tmp_path / "node1"))
+    assert ffcx.codegeneration.jit.cache_stats(tmp_path / "node1")["module_hits"] == 1
+
+
+def test_ir_cache(compile_args, tmp_path, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert ffcx.codegeneration.jit.cache_stats(tmp_path)["ir"] == 1
+
+    # Changing a code generation parameter reuses the IR
+    def compute_ir(*args, **kwargs):
+        raise AssertionError("IR should have been loaded from the cache")
+    monkeypatch.setattr(ffcx.compiler, "compute_ir", compute_ir)
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={"padlen": 4}, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert compiled_forms[0].rank == 2
+    assert ffcx.codegeneration.jit.cache_stats(tmp_path)["modules"] == 2
+
+    # A different basix version gives a different key
+    p = ffcx.parameters.get_parameters()
+    key = ffcx.compiler._ir_cache_key(forms, {}, "JIT", p)
+    monkeypatch.setattr(basix, "__version__", basix.__version__ + ".post1")
+    assert ffcx.compiler._ir_cache_key(forms, {}, "JIT", p) != key
@@ -19,3 +19,15 @@ def test_visualise():
     subprocess.run(["ffcx", "--visualise", "Poisson.ufl"])
     assert os.path.isfile("S.pdf")
     assert os.path.isfile("F.pdf")
+
+
+def test_cache_stats(tmp_path):
+    result = subprocess.run(["ffcx", "cache", "stats", str(tmp_path)], stdout=subprocess.PIPE, check=True)
+    assert b"modules: 0" in result.stdout
+
+
+def test_bundle(tmp_path):
+    os.chdir(os.path.dirname(__file__))
+    bundle = tmp_path / "Poisson.tar.gz"
+    subprocess.run(["ffcx", "bundle", "-o", str(bundle), "Poisson.ufl"], check=True)
+    assert bundle.is_file()
@@ -0,0 +1,80 @@
+# Copyright (C) 2021 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Scaling of the IR graph algorithms with graph size."""
+
+import os
+import time
+
+import pytest
+
+import ufl
+from ffcx.ir.analysis.factorization import compute_argument_factorization
+from ffcx.ir.analysis.graph import build_scalar_graph
+
+
+def balanced_sum(terms):
+    """Sum terms as a balanced tree, since UFL is slow with deeply nested sums."""
+    if len(terms) == 1:
+        return terms[0]
+    return balanced_sum(terms[:len(terms) // 2]) + balanced_sum(terms[len(terms) // 2:])
+
+
+def integrand(n):
+    """Integrand of a linear form with n distinct terms."""
+    element = ufl.VectorElement("Lagrange", ufl.triangle, 1)
+    v = ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    form = balanced_sum([ufl.dot(ufl.as_vector((f[0] + float(i), f[1] * float(i))), v) for i in range(n)]) * ufl.dx
+    form_data = ufl.algorithms.compute_form_data(
+        form,
+        do_apply_function_pullbacks=True,
+        do_apply_integral_scaling=True,
+        do_apply_geometry_lowering=True,
+        preserve_geometry_types=(ufl.classes.Jacobian, ),
+        do_apply_restrictions=True,
+        do_append_everywhere_integrals=False,
+        complex_mode=False)
+    return form_data.integral_data[0].integrals[0].integrand()
+
+
+def graph_size(expression):
+    """Total number of nodes and of CSR edge entries of the scalar graph and factorization."""
+    S = build_scalar_graph(expression)
+    F = compute_argument_factorization(S, 1)
+    size = 0
+    for G in (S, F):
+        offsets, indices = G.edges_csr()
+        assert len(offsets) == G.number_of_nodes() + 1
+        size += G.number_of_nodes() + len(indices)
+    return size
+
+
+def time_graph_algorithms(expression, repeats=3):
+    """Best time of building the scalar graph and factorization."""
+    best = float("inf")
+    for i in range(repeats):
+        start = time.perf_counter()
+        S = build_scalar_graph(expression)
+        F = compute_argument_factorization(S, 1)
+        best = min(best, time.perf_counter() - start)
+    return best, S.number_of_nodes() + F.number_of_nodes()
+
+
+def test_graph_size():
+    # Distinct terms each add the same number of nodes and edges
+    sizes = {n: graph_size(integrand(n)) for n in (100, 200, 400)}
+    assert sizes[400] - sizes[200] == 2 * (sizes[200] - sizes[100])
+
+
+@pytest.mark.skipif(not os.environ.get("FFCX_BENCHMARK"), reason="Benchmark, set FFCX_BENCHMARK=1 to run")
+def test_graph_scaling():
+    times = {n: time_graph_algorithms(integrand(n)) for n in (100, 400)}
+    for n, (t, size) in times.items():
+        print("terms: {}, graph nodes: {}, time: {:.3f}s".format(n, size, t))
+
+    # Linear scaling gives a ratio of about 4, quadratic about 16
+    (t0, size0), (t1, size1) = times[100], times[400]
+    assert t1 / t0 < 2 * size1 / size0
@@ -135,3 +135,42 @@ def test_rank1(compile_args):
     u_correct = np.array([f[1], f[0]]) + gradf0
 
     assert np.allclose(u_ffcx, u_correct.T)
+
+
+def test_zero_component(compile_args):
+    """Tests evaluation of an expression with a component whose tables are all zero.
+
+    Second derivatives of P1 functions are tabulated as zero tables,
+    which are eliminated from all components of the expression.
+
+    """
+    e = ufl.FiniteElement("P", "triangle", 1)
+    mesh = ufl.Mesh(ufl.VectorElement("P", "triangle", 1))
+    V = ufl.FunctionSpace(mesh, e)
+    f = ufl.Coefficient(V)
+
+    expr = ufl.as_vector([f, f.dx(0) + f.dx(0).dx(1), f.dx(1).dx(1)])
+
+    points = np.array([[0.0, 0.0], [0.5, 0.0], [0.25, 0.5]])
+    obj, module = ffcx.codegeneration.jit.compile_expressions([(expr, points)], cffi_extra_compile_args=compile_args)
+
+    ffi = cffi.FFI()
+    kernel = obj[0][0]
+
+    c_type, np_type = float_to_type("double")
+
+    A = np.zeros((3, 3), dtype=np_type)
+    w = np.array([1.0, 2.0, 4.0], dtype=np_type)
+    c = np.array([0.0], dtype=np_type)
+
+    # Reference cell
+    coords = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0], dtype=np.float64)
+    kernel.tabulate_expression(
+        ffi.cast('{type} *'.format(type=c_type), A.ctypes.data),
+        ffi.cast('{type} *'.format(type=c_type), w.ctypes.data),
+        ffi.cast('{type} *'.format(type=c_type), c.ctypes.data),
+        ffi.cast('double *', coords.ctypes.data))
+
+    f_points = w[0] + (w[1] - w[0]) * points[:, 0] + (w[2] - w[0]) * points[:, 1]
+    A_correct = np.array([f_points, np.full(3, w[1] - w[0]), np.zeros(3)]).T
+    assert np.allclose(A, A_correct)
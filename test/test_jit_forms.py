@@ -4,11 +4,16 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import threading
+
 import cffi
 import numpy as np
 import pytest
 
+import ffcx.codegeneration.batching
 import ffcx.codegeneration.jit
+import ffcx.compiler
+import ffcx.parameters
 import ufl
 import sympy
 
@@ -671,3 +676,316 @@ def test_lagrange_tetrahedron(compile_args, order, mode, sym_fun, ufl_fun):
                 ffi.NULL,
                 ffi.cast('double *', new_coords.ctypes.data), ffi.NULL, ffi.NULL, perm)
             assert np.allclose(b[start:end], perm_b[start:end])
+
+
+def test_parallel_kernel_compilation(compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + u * v * ufl.ds
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        [a], cffi_extra_compile_args=compile_args, jobs=2, ir_jobs=2)
+
+    form0 = compiled_forms[0][0]
+    assert form0.num_cell_integrals == 1
+    assert form0.num_exterior_facet_integrals == 1
+
+    ffi = cffi.FFI()
+    A = np.zeros((3, 3), dtype=np.float64)
+    w = np.array([], dtype=np.float64)
+    c = np.array([], dtype=np.float64)
+    coords = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0], dtype=np.float64)
+
+    integral = form0.create_cell_integral(-1)
+    integral.tabulate_tensor(
+        ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+        ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+        ffi.NULL, ffi.NULL, 0)
+
+    expected = np.array([[1.0, -0.5, -0.5], [-0.5, 0.5, 0.0], [-0.5, 0.0, 0.5]])
+    assert np.allclose(A, expected)
+
+
+def test_async_compilation(compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+
+    future = ffcx.codegeneration.jit.compile_forms_async([a], cffi_extra_compile_args=compile_args)
+    compiled_forms, module = future.result()
+
+    form0 = compiled_forms[0][0]
+    assert form0.rank == 2
+    assert form0.num_cell_integrals == 1
+
+
+def test_lazy_objects(compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx, ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, cffi_extra_compile_args=compile_args, lazy=True)
+    assert len(compiled_forms) == 2
+    assert compiled_forms[1].rank == 2
+
+    # Objects are created once and reused
+    assert compiled_forms[1] is compiled_forms[1]
+    eager_forms, _ = ffcx.codegeneration.jit.compile_forms(forms, cffi_extra_compile_args=compile_args)
+    assert eager_forms[1] is compiled_forms[1]
+
+
+def test_parallel_ir():
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    a0 = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + f * u * v * ufl.ds(1) + u('+') * v('-') * ufl.dS
+    a1 = f * u * v * ufl.dx(0) + u * v * ufl.dx(1)
+
+    parameters = ffcx.parameters.get_parameters()
+    code = ffcx.compiler.compile_ufl_objects([a0, a1], prefix="test", parameters=parameters)
+    code_parallel = ffcx.compiler.compile_ufl_objects([a0, a1], prefix="test", parameters=parameters, jobs=2)
+    assert code_parallel == code
+
+
+@pytest.mark.parametrize("simd_width", [0, 4])
+def test_batched_tabulate_tensor(simd_width, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    kappa = ufl.Constant(ufl.triangle)
+    a = (kappa * ufl.sqrt(1 + f**2) * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+         + f * u * v * ufl.ds + ufl.inner(ufl.jump(ufl.grad(u)), ufl.jump(ufl.grad(v))) * ufl.dS)
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        [a], parameters={"batch_kernels": True, "simd_width": simd_width}, cffi_extra_compile_args=compile_args)
+    form0 = compiled_forms[0][0]
+
+    ffi = cffi.FFI()
+    rng = np.random.default_rng(1)
+
+    # A batch of cells which does not fill a whole number of blocks
+    num_cells = 75
+    c = np.array([2.0])
+    integrals = [(form0.create_cell_integral(-1), 1), (form0.create_exterior_facet_integral(-1), 1),
+                 (form0.create_interior_facet_integral(-1), 2)]
+    for integral, num_restrictions in integrals:
+        A = np.zeros((num_cells, (6 * num_restrictions) ** 2))
+        w = rng.random((num_cells, 6 * num_restrictions))
+        coords = np.tile([0.0, 0.0, 1.0, 0.0, 0.0, 1.0] * num_restrictions, (num_cells, 1))
+        coords += 0.2 * rng.random(coords.shape)
+        facets = rng.integers(0, 3, (num_cells, num_restrictions), dtype=np.intc)
+        perms = rng.integers(0, 2, (num_cells, num_restrictions), dtype=np.uint8)
+        for i in range(num_cells):
+            integral.tabulate_tensor(
+                ffi.cast('double *', A[i].ctypes.data), ffi.cast('double *', w[i].ctypes.data),
+                ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords[i].ctypes.data),
+                ffi.cast('int *', facets[i].ctypes.data), ffi.cast('uint8_t *', perms[i].ctypes.data), 0)
+
+        # Arguments in structure-of-arrays layout
+        A_batch = np.zeros(A.T.shape)
+        w, coords, facets, perms = (np.ascontiguousarray(x.T) for x in (w, coords, facets, perms))
+        cell_permutation = np.zeros(num_cells, dtype=np.uint32)
+        integral.tabulate_tensor_batch(
+            num_cells, ffi.cast('double *', A_batch.ctypes.data), ffi.cast('double *', w.ctypes.data),
+            ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+            ffi.cast('int *', facets.ctypes.data), ffi.cast('uint8_t *', perms.ctypes.data),
+            ffi.cast('uint32_t *', cell_permutation.ctypes.data))
+        assert np.allclose(A_batch.T, A)
+
+
+def test_batched_tabulate_tensor_fallback(compile_args, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+
+    # Batched kernels are only generated on request
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms([a], cffi_extra_compile_args=compile_args)
+    assert compiled_forms[0][0].create_cell_integral(-1).tabulate_tensor_batch == cffi.FFI().NULL
+
+    # Integrals the batcher cannot rewrite have none
+    def batch(self, body):
+        raise RuntimeError("Cannot batch")
+    monkeypatch.setattr(ffcx.codegeneration.batching.CellBatcher, "batch", batch)
+    parameters = ffcx.parameters.get_parameters({"batch_kernels": True})
+    code_h, code_c = ffcx.compiler.compile_ufl_objects([a], prefix="test", parameters=parameters)
+    assert "integral->tabulate_tensor_batch = NULL;" in code_c
+
+
+@pytest.mark.parametrize("cell,degree", [(ufl.quadrilateral, 2), (ufl.quadrilateral, 3), (ufl.hexahedron, 2)])
+def test_sum_factorization(cell, degree, compile_args):
+    element = ufl.FiniteElement("Q", cell, degree)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    a = f * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + u.dx(0) * v * ufl.dx + u * v * ufl.dx
+    L = f * v.dx(1) * ufl.dx
+
+    ffi = cffi.FFI()
+    rng = np.random.default_rng(2)
+    ndofs = (degree + 1) ** cell.topological_dimension()
+    vertices = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [1.0, 1.0, 0.0],
+                         [0.0, 0.0, 1.0], [1.0, 0.0, 1.0], [0.0, 1.0, 1.0], [1.0, 1.0, 1.0]])
+    coords = vertices[:cell.num_vertices()] + 0.2 * rng.random((cell.num_vertices(), 3))
+    w = rng.random(ndofs)
+    c = np.array([], dtype=np.float64)
+
+    results = []
+    for sum_factorization in (True, False):
+        compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+            [a, L], parameters={"sum_factorization": sum_factorization}, cffi_extra_compile_args=compile_args)
+        tensors = []
+        for form, rank in zip(compiled_forms, (2, 1)):
+            A = np.zeros(ndofs ** rank)
+            form[0].create_cell_integral(-1).tabulate_tensor(
+                ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+                ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+                ffi.NULL, ffi.NULL, 0)
+            tensors.append(A)
+        results.append(tensors)
+
+    for A, A_ref in zip(*results):
+        assert np.abs(A).max() > 0.0
+        assert np.allclose(A, A_ref)
+
+
+def test_sum_factorization_high_degree(compile_args):
+    # The temporaries of a high degree hexahedron kernel must fit on a
+    # small thread stack
+    element = ufl.FiniteElement("Q", ufl.hexahedron, 5)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + u * v * ufl.dx
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        [a], parameters={"sum_factorization": True}, cffi_extra_compile_args=compile_args)
+
+    ffi = cffi.FFI()
+    ndofs = 6 ** 3
+    A = np.zeros(ndofs ** 2)
+    w = np.array([], dtype=np.float64)
+    c = np.array([], dtype=np.float64)
+    coords = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [1.0, 1.0, 0.0],
+                       [0.0, 0.0, 1.0], [1.0, 0.0, 1.0], [0.0, 1.0, 1.0], [1.0, 1.0, 1.0]])
+    integral = compiled_forms[0].create_cell_integral(-1)
+
+    def tabulate():
+        integral.tabulate_tensor(
+            ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+            ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+            ffi.NULL, ffi.NULL, 0)
+
+    stack_size = threading.stack_size(1 << 20)
+    try:
+        thread = threading.Thread(target=tabulate)
+        thread.start()
+        thread.join()
+    finally:
+        threading.stack_size(stack_size)
+
+    # The stiffness rows sum to zero and the mass matrix to the volume
+    A = A.reshape(ndofs, ndofs)
+    assert np.allclose(A, A.T)
+    assert np.isclose(A.sum(), 1.0)
+
+
+@pytest.mark.parametrize("cell,degree", [(ufl.triangle, 1), (ufl.triangle, 3), (ufl.tetrahedron, 2),
+                                         (ufl.tetrahedron, 3)])
+def test_preintegration(cell, degree, compile_args):
+    element = ufl.FiniteElement("Lagrange", cell, degree)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    kappa = ufl.Constant(cell)
+    a = kappa * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + u.dx(0) * v * ufl.dx + u * v * ufl.ds
+    L = kappa * v * ufl.dx
+
+    ffi = cffi.FFI()
+    rng = np.random.default_rng(3)
+    tdim = cell.topological_dimension()
+    ndofs = int(sympy.binomial(degree + tdim, tdim))
+    coords = np.zeros((tdim + 1, 3))
+    coords[1:, :tdim] = np.identity(tdim)
+    coords += 0.2 * rng.random(coords.shape)
+    w = np.array([], dtype=np.float64)
+    c = np.array([2.0])
+    quadrature_perm = np.zeros(1, dtype=np.uint8)
+
+    results = []
+    for preintegration in (True, False):
+        compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+            [a, L], parameters={"preintegration": preintegration}, cffi_extra_compile_args=compile_args)
+        tensors = []
+        for form, rank in zip(compiled_forms, (2, 1)):
+            integrals = [(form[0].create_cell_integral(-1), [0], 0)]
+            if rank == 2:
+                integrals += [(form[0].create_exterior_facet_integral(-1), [facet], 0) for facet in range(tdim + 1)]
+            integrals += [(form[0].create_cell_integral(-1), [0], perm) for perm in rng.integers(1, 64, 3)]
+            for integral, facet, perm in integrals:
+                A = np.zeros(ndofs ** rank)
+                facet = np.array(facet, dtype=np.intc)
+                integral.tabulate_tensor(
+                    ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+                    ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+                    ffi.cast('int *', facet.ctypes.data), ffi.cast('uint8_t *', quadrature_perm.ctypes.data),
+                    int(perm))
+                tensors.append(A)
+        results.append(tensors)
+
+    for A, A_ref in zip(*results):
+        assert np.abs(A).max() > 0.0
+        assert np.allclose(A, A_ref)
+
+
+@pytest.mark.parametrize("cell,family,degree,shape", [(ufl.triangle, "Lagrange", 2, ()),
+                                                      (ufl.tetrahedron, "Lagrange", 2, ()),
+                                                      (ufl.triangle, "Lagrange", 2, (2, )),
+                                                      (ufl.quadrilateral, "Q", 2, ())])
+def test_symmetric_element_tensor(cell, family, degree, shape, compile_args):
+    if shape:
+        element = ufl.VectorElement(family, cell, degree)
+    else:
+        element = ufl.FiniteElement(family, cell, degree)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(ufl.FiniteElement(family, cell, 1))
+    kappa = ufl.Constant(cell)
+    a = (1 + f**2) * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + kappa * ufl.inner(u, v) * ufl.dx
+    if shape:
+        a += ufl.div(u) * ufl.div(v) * ufl.dx
+    a_facets = ufl.inner(ufl.jump(u), ufl.jump(v)) * ufl.dS + ufl.inner(u, v) * ufl.ds
+    forms = [a, a_facets, ufl.inner(u.dx(0), v) * ufl.dx]
+
+    ffi = cffi.FFI()
+    rng = np.random.default_rng(4)
+    tdim = cell.topological_dimension()
+    num_vertices = cell.num_vertices()
+    if cell == ufl.quadrilateral:
+        coords = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [1.0, 1.0, 0.0]])
+    else:
+        coords = np.zeros((tdim + 1, 3))
+        coords[1:, :tdim] = np.identity(tdim)
+    coords = np.tile(coords + 0.2 * rng.random(coords.shape), (2, 1))
+    w = rng.random(2 * num_vertices)
+    c = np.array([2.0])
+    facets = np.array([0, 1], dtype=np.intc)
+    perms = np.zeros(2, dtype=np.uint8)
+
+    results = []
+    for symmetry in (True, False):
+        compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+            forms, parameters={"symmetry": symmetry}, cffi_extra_compile_args=compile_args)
+        tensors = []
+        for form in compiled_forms:
+            ndofs = form[0].create_finite_element(0).space_dimension
+            integrals = [(form[0].create_cell_integral(-1), 1), (form[0].create_exterior_facet_integral(-1), 1),
+                         (form[0].create_interior_facet_integral(-1), 2)]
+            for integral, num_restrictions in integrals:
+                if integral == ffi.NULL:
+                    continue
+                # Element tensors are added to A
+                A = np.ones((ndofs * num_restrictions) ** 2)
+                integral.tabulate_tensor(
+                    ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+                    ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+                    ffi.cast('int *', facets.ctypes.data), ffi.cast('uint8_t *', perms.ctypes.data), 0)
+                tensors.append(A)
+        results.append(tensors)
+
+    assert len(results[0]) == 4
+    for A, A_ref in zip(*results):
+        assert np.abs(A - 1.0).max() > 0.0
+        assert np.allclose(A, A_ref)